@@ -5,6 +5,7 @@ import logging
 
 from dmap_lib import rendering, schema
 from dmap_lib.analysis import analyze_image
+from dmap_lib.analysis.color import PALETTE_CACHE_DIR
 from dmap_lib.log_utils import setup_logging
 
 
@@ -45,6 +46,14 @@ def get_cli_args():
         action="store_true",
         help="Disables the rendering of all Feature objects.",
     )
+    p.add_argument(
+        "--palette-cache",
+        nargs="?",
+        const=PALETTE_CACHE_DIR,
+        metavar="DIR",
+        help="Cache fitted color palettes to speed up re-runs on the same image "
+        f"(default DIR: {PALETTE_CACHE_DIR}).",
+    )
     # Logging arguments
     g_log = p.add_argument_group("Logging & Output")
     g_log.add_argument("-v", "--verbose", action="store_true", help="Enable INFO logging.")
@@ -162,6 +171,7 @@ def main():
                     llm_model=args.llm_model,
                     llm_temp=args.llm_temp,
                     llm_ctx_size=args.llm_ctx_size,
+                    palette_cache_dir=args.palette_cache,
                 )
                 log.info("Saving analysis to '%s'...", json_path)
                 schema.save_json(map_data, json_path)
@@ -5,12 +5,11 @@ from typing import List, Dict, Any, Tuple, Optional
 
 import cv2
 import numpy as np
-from sklearn.cluster import KMeans
 
 from dmap_lib import schema, rendering
 from .color import ColorAnalyzer
 from .structure import StructureAnalyzer
-from .features import FeatureExtractor, LLMFeatureEnhancer
+from .features import FeatureExtractor, LLMFeatureEnhancer, grid_to_px
 from .transformer import MapTransformer
 from .context import _RegionAnalysisContext
 from .regions import detect_content_regions, parse_text_metadata
@@ -21,8 +20,8 @@ log = logging.getLogger("dmap.analysis")
 class MapAnalyzer:
     """Orchestrates the entire map analysis pipeline for a single region."""
 
-    def __init__(self):
-        self.color_analyzer = ColorAnalyzer()
+    def __init__(self, palette_cache_dir: Optional[str] = None):
+        self.color_analyzer = ColorAnalyzer(cache_dir=palette_cache_dir)
         self.structure_analyzer = StructureAnalyzer()
         self.feature_extractor = FeatureExtractor()
         self.map_transformer = MapTransformer()
@@ -48,19 +47,11 @@ class MapAnalyzer:
         label_color = (255, 255, 255)
 
         for layer in enhancements.get("layers", []):
-            px_verts = (
-                np.array(
-                    [(v["x"] * grid_size, v["y"] * grid_size) for v in layer["gridVertices"]]
-                )
-            ).astype(np.int32)
+            px_verts = grid_to_px(layer["gridVertices"], grid_size)
             cv2.drawContours(debug_img, [px_verts], -1, layer_color, 2)
 
         for feature in enhancements.get("features", []):
-            px_verts = (
-                np.array(
-                    [(v["x"] * grid_size, v["y"] * grid_size) for v in feature["gridVertices"]]
-                )
-            ).astype(np.int32)
+            px_verts = grid_to_px(feature["gridVertices"], grid_size)
 
             if "door" in feature.get("featureType", ""):
                 x, y, w, h = cv2.boundingRect(px_verts)
@@ -108,23 +99,27 @@ class MapAnalyzer:
         if img is None:
             raise ValueError("Input image to analyze_region cannot be None")
 
-        color_profile, kmeans_model = self.color_analyzer.analyze(img)
-        labels = kmeans_model.predict(img.reshape(-1, 3))
+        # The color analysis labels every pixel once; all later stages share that map.
+        color_profile = self.color_analyzer.analyze(img)
+        labels = color_profile["labels"]
         context = _RegionAnalysisContext()
 
         log.info("Executing Stage 4: Structural Image Preparation...")
-        structural_img = self._create_structural_image(img, color_profile, kmeans_model)
-        floor_only_img = self._create_floor_only_image(img, color_profile, kmeans_model)
-        stroke_only_img = self._create_stroke_only_image(img, color_profile, kmeans_model)
+        # One stroke mask serves the room bounds and every structural stage.
+        stroke_mask = self._create_stroke_only_mask(color_profile, labels)
 
-        context.room_bounds = self._find_room_bounds(stroke_only_img)
-        grid_info = self.structure_analyzer.discover_grid(
-            structural_img, color_profile, context.room_bounds
-        )
+        context.room_bounds = self._find_room_bounds(stroke_mask)
+        grid_info = self.structure_analyzer.discover_grid(stroke_mask, context.room_bounds)
 
         debug_canvas = None
         if save_intermediate_path:
-            # Create the base canvas for debugging structure analysis
+            # Create the base canvas for debugging structure analysis, painting the
+            # two-color structural image back from the stroke mask.
+            structural_img = np.where(
+                stroke_mask[..., None] > 0,
+                color_profile["stroke_bgr"],
+                color_profile["floor_bgr"],
+            ).astype(np.uint8)
             h, w, _ = structural_img.shape
             overlay = structural_img.copy()
             cv2.rectangle(overlay, (0, 0), (w, h), (0, 0, 0), -1)
@@ -140,7 +135,7 @@ class MapAnalyzer:
 
         log.info("⚙️  Executing Stage 6: Environmental Layer Detection...")
         context.enhancement_layers = self.feature_extractor.extract_layers(
-            img, grid_info, color_profile, kmeans_model, labels
+            img, grid_info, color_profile, labels
         )
 
         if save_intermediate_path:
@@ -154,21 +149,15 @@ class MapAnalyzer:
             )
 
         log.info("Refining floor plan based on detected layers...")
-        corrected_floor = floor_only_img.copy()
+        # The floor mask is built here and refined in place; nothing else reads it.
+        corrected_floor = self._create_floor_only_image(color_profile, labels)
         if context.enhancement_layers.get("layers"):
             log.info(
                 "Refining floor plan using %d detected environmental layer(s).",
                 len(context.enhancement_layers["layers"]),
             )
             for layer in context.enhancement_layers["layers"]:
-                px_verts = (
-                    np.array(
-                        [
-                            (v["x"] * grid_info.size, v["y"] * grid_info.size)
-                            for v in layer["gridVertices"]
-                        ]
-                    )
-                ).astype(np.int32)
+                px_verts = grid_to_px(layer["gridVertices"], grid_info.size)
                 cv2.fillPoly(corrected_floor, [px_verts], 255)
 
         if save_intermediate_path:
@@ -182,10 +171,9 @@ class MapAnalyzer:
         )
 
         context.tile_grid = self.structure_analyzer.classify_features(
-            structural_img,
+            stroke_mask,
             corrected_floor,
             grid_info,
-            color_profile,
             tile_classifications,
             debug_canvas=debug_canvas,
         )
@@ -196,20 +184,22 @@ class MapAnalyzer:
             room_contours,
             grid_info,
             color_profile,
-            kmeans_model,
             context.enhancement_layers,
             labels,
         )
 
         self.structure_analyzer.detect_passageway_doors(
             context.tile_grid,
-            structural_img,
+            stroke_mask,
             grid_info,
-            color_profile,
             context,
             debug_canvas,
         )
 
+        # The per-pixel masks and labels are done with; release them before the LLM
+        # and transformation stages.
+        del labels, color_profile, stroke_mask, corrected_floor
+
         if llm_mode and ollama_url and ollama_model:
             num_features = len(context.enhancement_layers.get("features", []))
             log.info(
@@ -252,7 +242,9 @@ class MapAnalyzer:
             log.info("\n%s", renderer.get_output(), extra={"raw": True})
             log.info("--- End ASCII Debug Output ---")
 
-        all_objects = self.map_transformer.transform(context, grid_info.size)
+        all_objects = self.map_transformer.transform(
+            context, grid_info.size, region_context["id"]
+        )
         return schema.Region(
             id=region_context["id"],
             label=region_context.get("label", region_context["id"]),
@@ -261,89 +253,42 @@ class MapAnalyzer:
             mapObjects=all_objects,
         )
 
-    def _create_stroke_only_image(
-        self, img: np.ndarray, color_profile: Dict[str, Any], kmeans: KMeans
-    ) -> np.ndarray:
-        """Creates a stroke-only image (black on white) for contour detection."""
-        log.debug("Creating stroke-only image for boundary analysis.")
-        stroke_roles = {r for r in color_profile["roles"].values() if r.endswith("stroke")}
-        rgb_to_label = {
-            tuple(c.astype("uint8")[::-1]): i for i, c in enumerate(kmeans.cluster_centers_)
-        }
-        stroke_labels = {
-            rgb_to_label[rgb]
-            for rgb, role in color_profile["roles"].items()
-            if role in stroke_roles
-        }
-
-        all_labels = kmeans.labels_.reshape(img.shape[:2])
-        stroke_mask = np.isin(all_labels, list(stroke_labels))
-
-        canvas = np.full_like(img, 255, dtype=np.uint8)
-        canvas[stroke_mask] = (0, 0, 0)
-        return canvas
-
-    def _create_structural_image(
-        self, img: np.ndarray, color_profile: Dict[str, Any], kmeans: KMeans
+    def _create_stroke_only_mask(
+        self, color_profile: Dict[str, Any], labels: np.ndarray
     ) -> np.ndarray:
-        """Creates a clean two-color image (stroke on floor) for analysis."""
-        log.debug("Creating two-color structural image (stroke on floor).")
-        stroke_roles = {r for r in color_profile["roles"].values() if r.endswith("stroke")}
-        rgb_to_label = {
-            tuple(c.astype("uint8")[::-1]): i for i, c in enumerate(kmeans.cluster_centers_)
-        }
-        stroke_labels = {
-            rgb_to_label[rgb]
-            for rgb, role in color_profile["roles"].items()
-            if role in stroke_roles
-        }
-
-        roles_inv = {v: k for k, v in color_profile["roles"].items()}
-        floor_rgb = roles_inv.get("floor", (255, 255, 255))
-        stroke_rgb = roles_inv.get("stroke", (0, 0, 0))
-        floor_bgr = np.array(floor_rgb[::-1], dtype="uint8")
-        stroke_bgr = np.array(stroke_rgb[::-1], dtype="uint8")
-
-        all_labels = kmeans.labels_.reshape(img.shape[:2])
-        stroke_mask = np.isin(all_labels, list(stroke_labels))
-
-        filtered_image = np.full_like(img, floor_bgr)
-        filtered_image[stroke_mask] = stroke_bgr
-
-        return filtered_image
+        """
+        Creates the binary mask of all stroke pixels (aliases included), used for
+        both room-bound detection and the structural stages.
+        """
+        log.debug("Creating stroke-only mask for structure analysis.")
+        stroke_labels = color_profile["stroke_labels"]
+
+        # Map each cluster straight to its mask value: one lookup over the labels,
+        # with no intermediate BGR image, grayscale conversion or threshold pass.
+        label_values = np.zeros(len(color_profile["palette"]), dtype=np.uint8)
+        label_values[stroke_labels] = 255
+        return label_values[labels]
 
     def _create_floor_only_image(
-        self, img: np.ndarray, color_profile: Dict[str, Any], kmeans: KMeans
+        self, color_profile: Dict[str, Any], labels: np.ndarray
     ) -> np.ndarray:
         """Creates a binary mask of all floor pixels for accurate contouring."""
         log.debug("Creating binary floor-only image mask.")
-        floor_roles = {r for r in color_profile["roles"].values() if "floor" in r}
-        rgb_to_label = {
-            tuple(c.astype("uint8")[::-1]): i for i, c in enumerate(kmeans.cluster_centers_)
-        }
-        floor_labels = {
-            rgb_to_label[rgb]
-            for rgb, role in color_profile["roles"].items()
-            if role in floor_roles
-        }
-
-        all_labels = kmeans.labels_.reshape(img.shape[:2])
-        floor_mask = np.isin(all_labels, list(floor_labels))
-
-        canvas = np.zeros(img.shape[:2], dtype=np.uint8)
-        canvas[floor_mask] = 255
-        return canvas
+        floor_labels = color_profile["floor_labels"]
+
+        label_values = np.zeros(len(color_profile["palette"]), dtype=np.uint8)
+        label_values[floor_labels] = 255
+        return label_values[labels]
 
     def _find_room_bounds(
         self,
-        stroke_only_image: np.ndarray,
+        stroke_only_mask: np.ndarray,
     ) -> List[Tuple[int, int, int, int]]:
-        """Finds bounding boxes of all major shapes in the stroke-only image."""
+        """Finds bounding boxes of all major shapes in the stroke-only mask."""
         log.debug("Finding room boundary boxes from strokes.")
-        gray = cv2.cvtColor(stroke_only_image, cv2.COLOR_BGR2GRAY)
-        _, binary_mask = cv2.threshold(gray, 230, 255, cv2.THRESH_BINARY_INV)
-
-        contours, _ = cv2.findContours(binary_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours, _ = cv2.findContours(
+            stroke_only_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
+        )
         bounds = []
         min_area = 1000
         for contour in contours:
@@ -372,10 +317,12 @@ def analyze_image(
     llm_model: Optional[str] = None,
     llm_temp: float = 0.3,
     llm_ctx_size: int = 8192,
+    palette_cache_dir: Optional[str] = None,
 ) -> schema.MapData:
     """
     Top-level orchestrator for the analysis pipeline. It will load the image,
     find distinct regions, and then run the core analysis on each region.
+    Fitted color palettes are cached in palette_cache_dir when it is given.
     """
     log.info("Starting analysis of image: '%s'", image_path)
     img = cv2.imread(image_path)
@@ -394,7 +341,7 @@ def analyze_image(
 
     log.info("Orchestrator found %d dungeon regions. Processing all.", len(dungeon_regions))
     final_regions = []
-    analyzer = MapAnalyzer()
+    analyzer = MapAnalyzer(palette_cache_dir=palette_cache_dir)
     for i, region_context in enumerate(dungeon_regions):
         region_img = region_context["bounds_img"]
         region_context["label"] = f"Dungeon Area {i+1}"
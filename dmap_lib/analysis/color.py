@@ -1,7 +1,10 @@
 # --- dmap_lib/analysis/color.py ---
+import contextlib
+import hashlib
 import logging
-from collections import Counter
-from typing import Tuple, Dict, Any
+import os
+import tempfile
+from typing import Tuple, Dict, Any, List, Optional
 
 import cv2
 import numpy as np
@@ -9,92 +12,201 @@ from sklearn.cluster import KMeans
 
 log = logging.getLogger("dmap.analysis")
 
+# Pixel labelling buckets each channel by its top bits: 2**5 buckets of 8 values.
+_LUT_SHIFT = 3
+_AMBIGUOUS = 255
+
+# The palette is fitted on at most this many randomly sampled pixels.
+_MAX_FIT_PIXELS = 200_000
+
+# Default location for the opt-in palette cache (see ColorAnalyzer's cache_dir).
+PALETTE_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "dmap", "palettes")
+
+
+def pack_rgb(rgb: Tuple[int, int, int]) -> int:
+    """Packs an (r, g, b) color into a single int key, 0xRRGGBB."""
+    return (int(rgb[0]) << 16) | (int(rgb[1]) << 8) | int(rgb[2])
+
+
+def unpack_rgb(key: int) -> Tuple[int, int, int]:
+    """Unpacks an int key made by pack_rgb back into an (r, g, b) tuple."""
+    return (key >> 16) & 0xFF, (key >> 8) & 0xFF, key & 0xFF
+
+
+def color_to_label(kmeans: KMeans, bgr: np.ndarray) -> int:
+    """Returns the label of the cluster centre nearest to a single BGR color."""
+    diff = kmeans.cluster_centers_ - np.asarray(bgr, dtype=np.float64)
+    return int(np.argmin((diff * diff).sum(axis=1)))
+
+
+def _most_common_labels(labels: np.ndarray, allowed: np.ndarray) -> np.ndarray:
+    """
+    Returns the distinct allowed labels in an array, most frequent first.
+
+    `allowed` is a boolean mask indexed by label. Ties keep their order of first
+    appearance, matching Counter.most_common.
+    """
+    labels = labels[allowed[labels]]
+    found, first_seen, counts = np.unique(labels, return_index=True, return_counts=True)
+    return found[np.lexsort((first_seen, -counts))]
+
+
+def _alias_roles(
+    aliases: List[Tuple[int, int, int]], primary_roles: List[Tuple[Tuple[int, int, int], str]]
+) -> List[str]:
+    """
+    Returns "alias_<role>" for each alias color, after its nearest primary color.
+
+    Distances are taken in a signed type, so uint8 channel differences cannot wrap
+    around and make a near-white or grey look closest to a dark color.
+    """
+    alias_rgb = np.array(aliases, dtype=np.int64)
+    primary_rgb = np.array([rgb for rgb, _ in primary_roles], dtype=np.int64)
+    diff = alias_rgb[:, None, :] - primary_rgb[None, :, :]
+    nearest = (diff**2).sum(axis=-1).argmin(axis=1)
+    return [f"alias_{primary_roles[idx][1]}" for idx in nearest]
+
 
 class ColorAnalyzer:
     """Encapsulates color quantization and semantic role assignment."""
 
-    def analyze(self, img: np.ndarray, num_colors: int = 8) -> Tuple[Dict[str, Any], KMeans]:
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.cache_dir = cache_dir
+
+    def _fit_kmeans(self, img: np.ndarray, pixels: np.ndarray, num_colors: int) -> KMeans:
+        """
+        Fits the palette KMeans, reusing a cached palette for this image if one exists.
+
+        Large images are fitted on a random pixel sample, as the handful of flat map
+        colors is well represented by it. Palettes are only cached when a cache_dir
+        is set; they are keyed by the image's full contents, so a cache hit gives
+        exactly the palette a cold fit of the same image would.
+        """
+        cache_path = None
+        if self.cache_dir:
+            digest = hashlib.sha1(np.ascontiguousarray(img).tobytes())
+            digest.update(f"{img.shape}:{num_colors}".encode())
+            cache_path = os.path.join(self.cache_dir, f"{digest.hexdigest()}.npy")
+            kmeans = self._load_cached_kmeans(cache_path, num_colors)
+            if kmeans is not None:
+                return kmeans
+
+        if len(pixels) > _MAX_FIT_PIXELS:
+            rng = np.random.default_rng(42)
+            pixels = pixels[rng.choice(len(pixels), _MAX_FIT_PIXELS, replace=False)]
+        # Fewer restarts on the sample can split the floor color and lose small layers.
+        kmeans = KMeans(n_clusters=num_colors, random_state=42, n_init=10).fit(pixels)
+        if cache_path:
+            self._save_cached_centers(cache_path, kmeans.cluster_centers_)
+        return kmeans
+
+    def _load_cached_kmeans(self, cache_path: str, num_colors: int) -> Optional[KMeans]:
+        """
+        Rebuilds a fitted KMeans from cached centres, or returns None on a miss.
+
+        Fitting on the centres themselves, one point per cluster, sets every fitted
+        attribute while leaving the centres exactly as they were cached.
+        """
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            centers = np.load(cache_path, allow_pickle=False)
+            if centers.shape != (num_colors, 3) or centers.dtype != np.float32:
+                raise ValueError(f"unexpected palette {centers.dtype} {centers.shape}")
+            kmeans = KMeans(n_clusters=num_colors, init=centers, n_init=1).fit(centers)
+            if not np.array_equal(kmeans.cluster_centers_, centers):
+                raise ValueError("cached centres did not survive the refit")
+        except Exception as e:
+            log.warning("Ignoring unusable palette cache '%s': %s", cache_path, e)
+            return None
+        log.debug("Reusing cached palette: %s", cache_path)
+        return kmeans
+
+    def _save_cached_centers(self, cache_path: str, centers: np.ndarray):
+        """Writes palette centres to the cache atomically, via a temporary file."""
+        tmp_path = None
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, centers)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            log.warning("Could not write palette cache '%s': %s", cache_path, e)
+            if tmp_path:
+                with contextlib.suppress(OSError):
+                    os.remove(tmp_path)
+
+    def analyze(self, img: np.ndarray, num_colors: int = 8) -> Dict[str, Any]:
         """
         Analyzes image colors and returns a color profile.
+
+        Role keys are RGB colors packed into ints (see pack_rgb).
         """
         log.info("⚙️  Executing Stage 3: Multi-Pass Color Analysis...")
-        pixels = img.reshape(-1, 3)
-        kmeans = KMeans(n_clusters=num_colors, random_state=42, n_init=10).fit(pixels)
+        # Fit on contiguous float32 pixels so predict() can stay in float32 as well.
+        pixels = np.ascontiguousarray(img.reshape(-1, 3), dtype=np.float32)
+        kmeans = self._fit_kmeans(img, pixels, num_colors)
         palette_bgr = kmeans.cluster_centers_.astype("uint8")
         palette_rgb = [tuple(c[::-1]) for c in palette_bgr]
+        # Packed RGB key of each cluster label, and the palette color behind each key.
+        label_keys = [pack_rgb(rgb) for rgb in palette_rgb]
+        key_to_rgb = dict(zip(label_keys, palette_rgb))
+        key_to_label = {key: i for i, key in enumerate(label_keys)}
 
         color_profile = {"palette": palette_rgb, "roles": {}}
         roles = color_profile["roles"]
-        unassigned_colors = list(palette_rgb)
-        all_labels = kmeans.labels_.reshape(img.shape[:2])
+        unassigned_colors = list(label_keys)
+        # The fit may have seen only a sample, so label every pixel explicitly.
+        all_labels = self.label_pixels(img, kmeans)
         h, w, _ = img.shape
 
         # --- Pass 1: Anchor Color Identification (Floor) ---
-        center_img = img[h // 4 : h * 3 // 4, w // 4 : w * 3 // 4, :]
-        center_pixels = center_img.reshape(-1, 3)
-        center_labels = kmeans.predict(center_pixels)
-        center_counts = Counter(center_labels)
-        floor_color = None
-        for label, _ in center_counts.most_common():
-            p_color = tuple(kmeans.cluster_centers_[label].astype("uint8")[::-1])
-            if p_color in unassigned_colors:
-                floor_color = p_color
-                break
-        if floor_color:
+        center_labels = all_labels[h // 4 : h * 3 // 4, w // 4 : w * 3 // 4].ravel()
+        is_unassigned = np.array([key in unassigned_colors for key in label_keys])
+        ranked = _most_common_labels(center_labels, is_unassigned)
+        floor_color = label_keys[ranked[0]] if len(ranked) else None
+        if floor_color is not None:
             roles[floor_color] = "floor"
             unassigned_colors.remove(floor_color)
 
         # --- Pass 2: Stroke Identification via Edge Sampling ---
         stroke_rgb = None
-        if floor_color:
-            floor_bgr = np.array(floor_color[::-1], dtype="uint8")
+        if floor_color is not None:
+            floor_bgr = np.array(unpack_rgb(floor_color)[::-1], dtype="uint8")
             floor_mask = cv2.inRange(img, floor_bgr, floor_bgr)
             contours, _ = cv2.findContours(
                 floor_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
             )
-            edge_pixels = []
-            for contour in contours:
-                for point in contour:
-                    edge_pixels.append(img[point[0][1], point[0][0]])
-
-            if edge_pixels:
-                edge_labels = kmeans.predict(edge_pixels)
-                valid_labels = [
-                    l
-                    for l in edge_labels
-                    if tuple(kmeans.cluster_centers_[l].astype("uint8")[::-1])
-                    in unassigned_colors
-                ]
-                if valid_labels:
-                    stroke_label = Counter(valid_labels).most_common(1)[0][0]
-                    stroke_rgb = tuple(
-                        kmeans.cluster_centers_[stroke_label].astype("uint8")[::-1]
-                    )
+            if contours:
+                edge_points = np.vstack(contours).reshape(-1, 2)
+                edge_labels = all_labels[edge_points[:, 1], edge_points[:, 0]]
+                is_unassigned = np.array([key in unassigned_colors for key in label_keys])
+                ranked = _most_common_labels(edge_labels, is_unassigned)
+                if len(ranked):
+                    stroke_rgb = label_keys[ranked[0]]
                     roles[stroke_rgb] = "stroke"
                     unassigned_colors.remove(stroke_rgb)
 
         # Fallback if edge sampling fails
-        if not stroke_rgb and unassigned_colors:
-            stroke_rgb = min(unassigned_colors, key=sum)
+        if stroke_rgb is None and unassigned_colors:
+            stroke_rgb = min(unassigned_colors, key=lambda c: sum(key_to_rgb[c]))
             roles[stroke_rgb] = "stroke"
             unassigned_colors.remove(stroke_rgb)
 
         # --- Pass 3: Border Color Identification (Glow & Shadow) ---
-        stroke_label = kmeans.predict([np.array(stroke_rgb[::-1])])[0]
+        stroke_label = color_to_label(kmeans, unpack_rgb(stroke_rgb)[::-1])
         stroke_mask = (all_labels == stroke_label).astype(np.uint8)
-        dilated_mask = cv2.dilate(stroke_mask, np.ones((3, 3), np.uint8), iterations=2)
+        # One 5x5 rectangle equals two 3x3 passes and takes OpenCV's separable path.
+        ring_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
+        dilated_mask = cv2.dilate(stroke_mask, ring_kernel)
         search_mask = dilated_mask - stroke_mask
         adjacent_labels = all_labels[search_mask == 1]
-        valid_adj = [
-            l
-            for l in adjacent_labels
-            if tuple(kmeans.cluster_centers_[l].astype("uint8")[::-1]) in unassigned_colors
-        ]
-        if len(valid_adj) > 1:
-            top_two = [item[0] for item in Counter(valid_adj).most_common(2)]
-            c1 = tuple(kmeans.cluster_centers_[top_two[0]].astype("uint8")[::-1])
-            c2 = tuple(kmeans.cluster_centers_[top_two[1]].astype("uint8")[::-1])
-            if sum(c1) > sum(c2):
+        is_unassigned = np.array([key in unassigned_colors for key in label_keys])
+        if np.count_nonzero(is_unassigned[adjacent_labels]) > 1:
+            top_two = _most_common_labels(adjacent_labels, is_unassigned)[:2]
+            c1, c2 = label_keys[top_two[0]], label_keys[top_two[1]]
+            if sum(key_to_rgb[c1]) > sum(key_to_rgb[c2]):
                 glow_rgb, shadow_rgb = c1, c2
             else:
                 glow_rgb, shadow_rgb = c2, c1
@@ -106,10 +218,9 @@ class ColorAnalyzer:
         # --- Pass 4: Environmental Layer Identification (Water) ---
         if unassigned_colors:
             candidates = []
-            rgb_to_label = {tuple(c[::-1]): i for i, c in enumerate(palette_bgr)}
             for color in unassigned_colors:
-                label = rgb_to_label[color]
-                mask = (all_labels == label).astype(np.uint8) * 255
+                label = key_to_label[color]
+                mask = np.where(all_labels == label, np.uint8(255), np.uint8(0))
                 contours, _ = cv2.findContours(
                     mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
                 )
@@ -121,20 +232,80 @@ class ColorAnalyzer:
                     water_color = best[1]
                     roles[water_color] = "water"
                     unassigned_colors.remove(water_color)
-                    log.debug("Identified water color: %s", str(water_color))
+                    log.debug("Identified water color: %s", str(unpack_rgb(water_color)))
 
         # --- Pass 5: Final Alias Classification ---
-        primary_roles = list(roles.items())
-        if primary_roles:
-            for alias_color in unassigned_colors:
-                closest = min(
-                    primary_roles,
-                    key=lambda i: np.linalg.norm(np.array(alias_color) - np.array(i[0])),
-                )
-                roles[alias_color] = f"alias_{closest[1]}"
+        primary_roles = [(key_to_rgb[c], role) for c, role in roles.items()]
+        if primary_roles and unassigned_colors:
+            aliases = [key_to_rgb[c] for c in unassigned_colors]
+            alias_roles = _alias_roles(aliases, primary_roles)
+            for alias_color, role in zip(unassigned_colors, alias_roles):
+                roles[alias_color] = role
 
         log.debug("--- Advanced Color Profile ---")
         for color, role in roles.items():
-            log.debug("RGB: %-15s -> Role: %s", str(color), role)
+            log.debug("RGB: %-15s -> Role: %s", str(unpack_rgb(color)), role)
 
-        return color_profile, kmeans
+        # Lookups shared by the later stages, resolved once here.
+        roles_inv = {v: k for k, v in roles.items()}
+        color_profile["roles_inv"] = roles_inv
+        floor_key = roles_inv.get("floor", pack_rgb((255, 255, 255)))
+        stroke_key = roles_inv.get("stroke", pack_rgb((0, 0, 0)))
+        color_profile["floor_bgr"] = np.array(unpack_rgb(floor_key)[::-1], dtype="uint8")
+        color_profile["stroke_bgr"] = np.array(unpack_rgb(stroke_key)[::-1], dtype="uint8")
+        color_profile["labels"] = all_labels
+        # Labels of every stroke-like and floor-like cluster, aliases included.
+        color_profile["stroke_labels"] = sorted(
+            key_to_label[key] for key, role in roles.items() if role.endswith("stroke")
+        )
+        color_profile["floor_labels"] = sorted(
+            key_to_label[key] for key, role in roles.items() if "floor" in role
+        )
+        color_profile["floor_label"] = color_to_label(kmeans, color_profile["floor_bgr"])
+        color_profile["stroke_label"] = color_to_label(kmeans, color_profile["stroke_bgr"])
+        if "water" in roles_inv:
+            water_bgr = unpack_rgb(roles_inv["water"])[::-1]
+            color_profile["water_label"] = color_to_label(kmeans, water_bgr)
+
+        return color_profile
+
+    def label_pixels(self, img: np.ndarray, kmeans: KMeans) -> np.ndarray:
+        """
+        Returns the nearest-cluster label of every pixel, as kmeans.predict would,
+        as a uint8 array shaped like the image.
+
+        A 32x32x32 lookup table holds the label of each colour bucket whose eight
+        corners all share the same nearest centre; since nearest-centre regions are
+        convex, every colour inside such a bucket does too. Only the pixels that
+        land in the remaining, ambiguous buckets are passed to kmeans.predict.
+        """
+        bits = 8 - _LUT_SHIFT
+        step = 1 << _LUT_SHIFT
+        # The lowest and highest value of every bucket, for each channel.
+        edges = np.arange(0, 256, step)
+        corner_values = np.stack([edges, edges + step - 1], axis=1).reshape(-1)
+        corners = np.stack(np.meshgrid(*[corner_values] * 3, indexing="ij"), axis=-1)
+        corner_labels = kmeans.predict(corners.reshape(-1, 3).astype(np.float32))
+
+        n = len(edges)
+        corner_labels = corner_labels.reshape(n, 2, n, 2, n, 2)
+        first = corner_labels[:, :1, :, :1, :, :1].reshape(n, n, n)
+        unanimous = (corner_labels == first[:, None, :, None, :, None]).all(axis=(1, 3, 5))
+        lut = np.where(unanimous, first, _AMBIGUOUS).astype(np.uint8).reshape(-1)
+
+        # Pack the three bucket indices of each pixel into one flat LUT index.
+        pixels = img.reshape(-1, 3)
+        buckets = pixels >> _LUT_SHIFT
+        index = buckets[:, 0].astype(np.uint16)
+        index <<= bits
+        index |= buckets[:, 1]
+        index <<= bits
+        index |= buckets[:, 2]
+        labels = lut[index]
+
+        ambiguous = np.flatnonzero(labels == _AMBIGUOUS)
+        if ambiguous.size:
+            labels[ambiguous] = kmeans.predict(
+                np.ascontiguousarray(pixels[ambiguous], dtype=np.float32)
+            )
+        return labels.reshape(img.shape[:2])
@@ -6,7 +6,6 @@ import cv2
 import numpy as np
 from shapely.geometry import Polygon
 from shapely.ops import unary_union
-from sklearn.cluster import KMeans
 
 from dmap_lib.llm import query_llm
 from dmap_lib.prompts import LLM_PROMPT_CLASSIFIER, LLM_PROMPT_ORACLE
@@ -16,6 +15,12 @@ log = logging.getLogger("dmap.analysis")
 log_llm = logging.getLogger("dmap.llm")
 
 
+def grid_to_px(grid_vertices: List[Dict[str, float]], grid_size: int) -> np.ndarray:
+    """Scales a list of {"x", "y"} grid vertices to an int32 array of pixel points."""
+    coords = np.array([(v["x"], v["y"]) for v in grid_vertices], dtype=np.float64)
+    return (coords * grid_size).astype(np.int32)
+
+
 class FeatureExtractor:
     """Handles detection of non-grid-aligned features."""
 
@@ -30,9 +35,7 @@ class FeatureExtractor:
         max_area_elongated = (grid_size * grid_size) * 4.0
 
         for feature in features:
-            px_verts = np.array(
-                [(v["x"] * grid_size, v["y"] * grid_size) for v in feature["gridVertices"]]
-            ).astype(np.int32)
+            px_verts = grid_to_px(feature["gridVertices"], grid_size)
             area = cv2.contourArea(px_verts)
 
             _, (w, h), _ = cv2.minAreaRect(px_verts)
@@ -69,22 +72,17 @@ class FeatureExtractor:
         original_region_img: np.ndarray,
         grid_info: _GridInfo,
         color_profile: Dict[str, Any],
-        kmeans: KMeans,
         labels: np.ndarray,
     ) -> Dict[str, Any]:
         """Detects environmental layers (e.g., water) in the image."""
         enhancement_layers = {"layers": []}
-        roles_inv = {v: k for k, v in color_profile["roles"].items()}
+        roles_inv = color_profile["roles_inv"]
         grid_size = grid_info.size
 
         # --- 1. Detect Water Layers ---
         if "water" in roles_inv:
-            w_rgb = roles_inv["water"]
-            w_bgr = np.array(w_rgb[::-1], dtype="uint8")
-            w_cen = min(kmeans.cluster_centers_, key=lambda c: np.linalg.norm(c - w_bgr))
-            w_lab = kmeans.predict([w_cen])[0]
-            w_mask = (labels == w_lab).reshape(original_region_img.shape[:2])
-            w_mask_u8 = w_mask.astype("uint8") * 255
+            w_lab = color_profile["water_label"]
+            w_mask_u8 = np.where(labels == w_lab, np.uint8(255), np.uint8(0))
             cnts, _ = cv2.findContours(w_mask_u8, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
             for c in cnts:
                 if cv2.contourArea(c) > grid_size * grid_size:
@@ -93,12 +91,11 @@ class FeatureExtractor:
                     if poly.is_empty or not isinstance(poly, Polygon):
                         continue
 
+                    # Convert the whole ring to grid units at once
+                    offset = (grid_info.offset_x, grid_info.offset_y)
+                    grid_pts = (np.asarray(poly.exterior.coords) - offset) / grid_size
                     verts = [
-                        {
-                            "x": round((v[0] - grid_info.offset_x) / grid_size, 1),
-                            "y": round((v[1] - grid_info.offset_y) / grid_size, 1),
-                        }
-                        for v in poly.exterior.coords
+                        {"x": round(gx, 1), "y": round(gy, 1)} for gx, gy in grid_pts.tolist()
                     ]
                     enhancement_layers["layers"].append(
                         {
@@ -116,7 +113,6 @@ class FeatureExtractor:
         room_contours: List[np.ndarray],
         grid_info: _GridInfo,
         color_profile: Dict[str, Any],
-        kmeans: KMeans,
         enhancement_layers: Dict[str, Any],
         labels: np.ndarray,
     ) -> Dict[str, Any]:
@@ -125,27 +121,26 @@ class FeatureExtractor:
             log.debug("No room contours provided, skipping feature extraction.")
             return enhancement_layers
 
-        roles_inv = {v: k for k, v in color_profile["roles"].items()}
         grid_size = grid_info.size
-        h, w = original_region_img.shape[:2]
+
+        # Features lie inside the floor plan, so the masks only cover its bounding box.
+        bx, by, bw, bh = cv2.boundingRect(np.vstack(room_contours))
 
         # 1. Create a mask of all stroke pixels
-        s_rgb = roles_inv.get("stroke", (0, 0, 0))
-        s_bgr = np.array(s_rgb[::-1], dtype="uint8")
-        s_cen = min(kmeans.cluster_centers_, key=lambda c: np.linalg.norm(c - s_bgr))
-        s_lab = kmeans.predict([s_cen])[0]
-        s_mask = (labels == s_lab).reshape(h, w).astype("uint8") * 255
+        s_lab = color_profile["stroke_label"]
+        s_box = labels[by : by + bh, bx : bx + bw]
+        s_mask = np.where(s_box == s_lab, np.uint8(255), np.uint8(0))
 
         # 2. Create a mask of the floor plan
-        floor_mask = np.zeros((h, w), dtype="uint8")
-        cv2.drawContours(floor_mask, room_contours, -1, 255, -1)
+        floor_mask = np.zeros((bh, bw), dtype="uint8")
+        cv2.drawContours(floor_mask, room_contours, -1, 255, -1, offset=(-bx, -by))
 
         # 3. Create the final feature mask by finding strokes *inside* the floor plan
         feature_mask = cv2.bitwise_and(s_mask, floor_mask)
 
-        # 4. Find contours of the features directly
+        # 4. Find contours of the features directly, back in image coordinates
         contours, _ = cv2.findContours(
-            feature_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
+            feature_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(bx, by)
         )
 
         feature_candidates = []
@@ -223,11 +218,7 @@ class LLMFeatureEnhancer:
         crop_area_color = (255, 0, 255)
 
         for feature in enhancements.get("features", []):
-            px_verts = (
-                np.array(
-                    [(v["x"] * grid_size, v["y"] * grid_size) for v in feature["gridVertices"]]
-                )
-            ).astype(np.int32)
+            px_verts = grid_to_px(feature["gridVertices"], grid_size)
 
             # Draw the feature's primary bounding box
             x, y, w, h = cv2.boundingRect(px_verts)
@@ -302,11 +293,7 @@ class LLMFeatureEnhancer:
         geom_color, llm_color = (255, 0, 0), (0, 0, 255)
 
         for feature in geom_features:
-            px_verts = (
-                np.array(
-                    [(v["x"] * grid_size, v["y"] * grid_size) for v in feature["gridVertices"]]
-                )
-            ).astype(np.int32)
+            px_verts = grid_to_px(feature["gridVertices"], grid_size)
             x, y, w, h = cv2.boundingRect(px_verts)
             cv2.rectangle(debug_img, (x, y), (x + w, y + h), geom_color, 2)
 
@@ -347,11 +334,7 @@ class LLMFeatureEnhancer:
         feature_color = (0, 255, 0)
 
         for feature in classified_features:
-            px_verts = (
-                np.array(
-                    [(v["x"] * grid_size, v["y"] * grid_size) for v in feature["gridVertices"]]
-                )
-            ).astype(np.int32)
+            px_verts = grid_to_px(feature["gridVertices"], grid_size)
             x, y, w, h = cv2.boundingRect(px_verts)
             cv2.rectangle(debug_img, (x, y), (x + w, y + h), feature_color, 2)
             cv2.putText(
@@ -384,11 +367,7 @@ class LLMFeatureEnhancer:
         img_h, img_w = original_region_img.shape[:2]
 
         for feature in features:
-            px_verts = (
-                np.array(
-                    [(v["x"] * grid_size, v["y"] * grid_size) for v in feature["gridVertices"]]
-                )
-            ).astype(np.int32)
+            px_verts = grid_to_px(feature["gridVertices"], grid_size)
 
             # 1. Get the feature's precise bounding box and center
             x, y, w, h = cv2.boundingRect(px_verts)
@@ -519,10 +498,7 @@ class LLMFeatureEnhancer:
         # Pre-calculate centroids of geometrically detected features
         geom_centroids = []
         for feature in geom_features:
-            verts = np.array(
-                [(v["x"] * grid_size, v["y"] * grid_size) for v in feature["gridVertices"]]
-            )
-            M = cv2.moments(verts.astype(np.int32))
+            M = cv2.moments(grid_to_px(feature["gridVertices"], grid_size))
             geom_centroids.append(
                 (M["m10"] / M["m00"], M["m01"] / M["m00"]) if M["m00"] != 0 else None
             )
@@ -0,0 +1,157 @@
+# --- dmap_lib/analysis/kernels.py ---
+from typing import Tuple
+
+import numpy as np
+
+# Numba is optional: without it the kernels below run as plain Python.
+try:
+    from numba import njit
+
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """No-op stand-in for numba.njit when Numba is not installed."""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+
+# Step vectors for the tracing directions: east, south, west, north (y points down).
+_DIR_DX = np.array([1, 0, -1, 0], dtype=np.int32)
+_DIR_DY = np.array([0, 1, 0, -1], dtype=np.int32)
+
+
+@njit(cache=True)
+def _is_set(mask: np.ndarray, x: int, y: int) -> bool:
+    """Bounds-checked lookup of a tile in a 2D boolean mask."""
+    return 0 <= y < mask.shape[0] and 0 <= x < mask.shape[1] and mask[y, x]
+
+
+@njit(cache=True)
+def trace_tile_outlines(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Traces every boundary loop of the set tiles in a 2D boolean mask.
+
+    Loops follow tile edges with the set tiles on the right-hand side, so outer
+    boundaries come out clockwise (positive shoelace area with y pointing down)
+    and holes counter-clockwise. Tiles touching only at a corner are kept apart.
+    Every lattice point along a loop is emitted, one vertex per tile edge.
+
+    Returns an (N, 2) int32 array of (x, y) corner coordinates and an int32 array
+    of loop offsets into it, so loop i is vertices[offsets[i]:offsets[i + 1]].
+    """
+    h, w = mask.shape
+    visited_north = np.zeros((h, w), dtype=np.bool_)
+    vertices = np.empty((4 * h * w, 2), dtype=np.int32)
+    offsets = np.zeros(h * w + 1, dtype=np.int32)
+    n_verts = 0
+    n_loops = 0
+
+    for ty in range(h):
+        for tx in range(w):
+            if not mask[ty, tx] or visited_north[ty, tx] or _is_set(mask, tx, ty - 1):
+                continue
+            # Every loop has at least one north edge, so start from an unvisited one.
+            vx, vy, d = tx, ty, 0
+            while True:
+                vertices[n_verts, 0] = vx
+                vertices[n_verts, 1] = vy
+                n_verts += 1
+                if d == 0:
+                    visited_north[vy, vx] = True
+                vx += _DIR_DX[d]
+                vy += _DIR_DY[d]
+
+                # Tiles ahead of the vertex, to the right and left of the heading.
+                if d == 0:
+                    right, left = _is_set(mask, vx, vy), _is_set(mask, vx, vy - 1)
+                elif d == 1:
+                    right, left = _is_set(mask, vx - 1, vy), _is_set(mask, vx, vy)
+                elif d == 2:
+                    right, left = _is_set(mask, vx - 1, vy - 1), _is_set(mask, vx - 1, vy)
+                else:
+                    right, left = _is_set(mask, vx, vy - 1), _is_set(mask, vx - 1, vy - 1)
+
+                if not right:
+                    d = (d + 1) % 4
+                elif left:
+                    d = (d + 3) % 4
+
+                if vx == tx and vy == ty and d == 0:
+                    break
+            n_loops += 1
+            offsets[n_loops] = n_verts
+
+    return vertices[:n_verts], offsets[: n_loops + 1]
+
+
+@njit(cache=True)
+def ring_centroid(ring: np.ndarray) -> Tuple[float, float, float]:
+    """
+    Area centroid of a closed ring of float64 (x, y) points.
+
+    Shoelace terms are summed over a triangle fan from the first point, in ring
+    order, the same way GEOS accumulates them, so the result matches shapely's
+    Polygon.centroid exactly. Returns (cx, cy, doubled_area); the centroid is only
+    meaningful when the doubled area is non-zero.
+    """
+    x0, y0 = ring[0, 0], ring[0, 1]
+    area_sum, cx_sum, cy_sum = 0.0, 0.0, 0.0
+    for i in range(ring.shape[0] - 1):
+        x1, y1 = ring[i, 0], ring[i, 1]
+        x2, y2 = ring[i + 1, 0], ring[i + 1, 1]
+        area2 = (x1 - x0) * (y2 - y0) - (x2 - x0) * (y1 - y0)
+        area_sum += area2
+        cx_sum += area2 * (x0 + x1 + x2)
+        cy_sum += area2 * (y0 + y1 + y2)
+    if area_sum == 0.0:
+        return 0.0, 0.0, 0.0
+    return cx_sum / 3 / area_sum, cy_sum / 3 / area_sum, area_sum
+
+
+@njit(cache=True)
+def _point_in_ring(px: float, py: float, ring: np.ndarray, start: int, end: int) -> bool:
+    """
+    Crossing-number test of (px, py) against the ring ring[start:end], which may be
+    open or closed. Points on the ring itself are outside, as with shapely's contains.
+    """
+    inside = False
+    j = end - 1
+    for i in range(start, end):
+        x1, y1 = ring[j, 0], ring[j, 1]
+        x2, y2 = ring[i, 0], ring[i, 1]
+        j = i
+        if (
+            min(x1, x2) <= px <= max(x1, x2)
+            and min(y1, y2) <= py <= max(y1, y2)
+            and (x2 - x1) * (py - y1) == (y2 - y1) * (px - x1)
+        ):
+            return False
+        if (y1 > py) != (y2 > py) and px < (x2 - x1) * (py - y1) / (y2 - y1) + x1:
+            inside = not inside
+    return inside
+
+
+@njit(cache=True)
+def points_in_rings(
+    xs: np.ndarray,
+    ys: np.ndarray,
+    point_idx: np.ndarray,
+    ring_idx: np.ndarray,
+    vertices: np.ndarray,
+    offsets: np.ndarray,
+) -> np.ndarray:
+    """
+    Tests each (point, ring) candidate pair for strict containment.
+
+    Rings are stored like the output of trace_tile_outlines: ring r is
+    vertices[offsets[r]:offsets[r + 1]]. Returns a boolean array with one entry per
+    pair in point_idx / ring_idx.
+    """
+    inside = np.zeros(point_idx.shape[0], dtype=np.bool_)
+    for k in range(point_idx.shape[0]):
+        p, r = point_idx[k], ring_idx[k]
+        inside[k] = _point_in_ring(xs[p], ys[p], vertices, offsets[r], offsets[r + 1])
+    return inside
@@ -5,14 +5,31 @@ from typing import List, Dict, Any, Tuple
 import cv2
 import numpy as np
 import easyocr
+import torch
 
 log = logging.getLogger("dmap.analysis")
 log_ocr = logging.getLogger("dmap.ocr")
 
-# Initialize the OCR reader once. This can take a moment on first run.
-log_ocr.info("Initializing EasyOCR reader...")
-OCR_READER = easyocr.Reader(["en"], gpu=False)
-log_ocr.info("EasyOCR reader initialized.")
+# Region contours are traced on a mask pooled down by this factor in each axis.
+_REGION_SCALE = 4
+
+# Batched OCR is used from this many text regions up; fewer are read one by one.
+_OCR_BATCH_MIN = 3
+
+# The OCR reader is created on first use, as loading its models takes a moment.
+_OCR_READER = None
+
+
+def _get_ocr_reader() -> easyocr.Reader:
+    """Returns the shared EasyOCR reader, initializing it on the first call."""
+    global _OCR_READER
+    if _OCR_READER is None:
+        # With gpu=True, EasyOCR picks CUDA, then Apple MPS, then the CPU.
+        cuda = torch.cuda.is_available()
+        log_ocr.info("Initializing EasyOCR reader (cuda=%s)...", cuda)
+        _OCR_READER = easyocr.Reader(["en"], gpu=True, cudnn_benchmark=cuda)
+        log_ocr.info("EasyOCR reader initialized.")
+    return _OCR_READER
 
 
 def detect_content_regions(img: np.ndarray) -> List[Dict[str, Any]]:
@@ -20,13 +37,29 @@ def detect_content_regions(img: np.ndarray) -> List[Dict[str, Any]]:
     log.info("⚙️  Executing Stage 1: Region Detection...")
     gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
     _, thresh = cv2.threshold(gray, 230, 255, cv2.THRESH_BINARY_INV)
-    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    # Pool the mask so a small cell is set if any pixel under it is, then trace there.
+    scale = _REGION_SCALE
+    img_h, img_w = thresh.shape
+    pad_h, pad_w = -img_h % scale, -img_w % scale
+    padded = np.pad(thresh, ((0, pad_h), (0, pad_w)))
+    small = padded.reshape(
+        (img_h + pad_h) // scale, scale, (img_w + pad_w) // scale, scale
+    ).max(axis=(1, 3))
+    # Close small gaps so a region with breaks in its outline is not split apart.
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+    small = cv2.morphologyEx(small, cv2.MORPH_CLOSE, kernel)
+    contours, _ = cv2.findContours(small, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
     region_contexts = []
-    min_area = img.shape[0] * img.shape[1] * 0.01
+    min_area = img_h * img_w * 0.01
     for i, contour in enumerate(contours):
+        contour = contour * scale
         if cv2.contourArea(contour) > min_area:
             x, y, w, h = cv2.boundingRect(contour)
+            # Tighten the coarse rectangle to the full-resolution pixels inside it.
+            dx, dy, w, h = cv2.boundingRect(thresh[y : y + h + scale, x : x + w + scale])
+            x, y = x + dx, y + dy
             region_contexts.append(
                 {
                     "id": f"region_{i}",
@@ -57,6 +90,7 @@ def parse_text_metadata(
 
     metadata: Dict[str, Any] = {"title": None, "notes": "", "legend": ""}
     text_blobs = []
+    text_contexts = []
 
     for i, context in enumerate(region_contexts):
         if i == main_dungeon_idx:
@@ -65,11 +99,50 @@ def parse_text_metadata(
             continue
 
         context["type"] = "text"
-        log.debug("Region '%s' classified as 'text', running OCR.", context["id"])
-        ocr_res = OCR_READER.readtext(context["bounds_img"], detail=1, paragraph=False)
-        for bbox, text, prob in ocr_res:
-            h = bbox[2][1] - bbox[0][1]
-            text_blobs.append({"text": text, "height": h})
+        log.debug("Region '%s' classified as 'text', queued for OCR.", context["id"])
+        text_contexts.append(context)
+
+    if len(text_contexts) >= _OCR_BATCH_MIN:
+        # Batched OCR needs a common input size. Pad each crop with white to the largest
+        # height and width, so text keeps its shape and box heights stay in crop pixels.
+        crops = [context["bounds_img"] for context in text_contexts]
+        n_height = max(crop.shape[0] for crop in crops)
+        n_width = max(crop.shape[1] for crop in crops)
+        images = [
+            cv2.copyMakeBorder(
+                crop,
+                0,
+                n_height - crop.shape[0],
+                0,
+                n_width - crop.shape[1],
+                cv2.BORDER_CONSTANT,
+                value=(255, 255, 255),
+            )
+            for crop in crops
+        ]
+        log_ocr.debug(
+            "Running batched OCR on %d text regions at %dx%d.", len(images), n_width, n_height
+        )
+        batch_res = _get_ocr_reader().readtext_batched(
+            images,
+            n_width=n_width,
+            n_height=n_height,
+            batch_size=len(images),
+            detail=1,
+            paragraph=False,
+        )
+        for ocr_res in batch_res:
+            for bbox, text, prob in ocr_res:
+                h = bbox[2][1] - bbox[0][1]
+                text_blobs.append({"text": text, "height": h})
+    else:
+        for context in text_contexts:
+            ocr_res = _get_ocr_reader().readtext(
+                context["bounds_img"], detail=1, paragraph=False
+            )
+            for bbox, text, prob in ocr_res:
+                h = bbox[2][1] - bbox[0][1]
+                text_blobs.append({"text": text, "height": h})
 
     if text_blobs:
         title_idx = max(range(len(text_blobs)), key=lambda i: text_blobs[i]["height"])
@@ -2,8 +2,7 @@
 import logging
 import math
 import os
-from collections import Counter
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Tuple, Optional
 
 import cv2
 import numpy as np
@@ -22,9 +21,8 @@ class StructureAnalyzer:
     def detect_passageway_doors(
         self,
         tile_grid: Dict[Tuple[int, int], _TileData],
-        structural_img: np.ndarray,
+        stroke_mask: np.ndarray,
         grid_info: _GridInfo,
-        color_profile: Dict[str, Any],
         context: _RegionAnalysisContext,
         debug_canvas: Optional[np.ndarray] = None,
     ):
@@ -33,9 +31,6 @@ class StructureAnalyzer:
         are found within tiles. Operates on an ABSOLUTE grid.
         """
         log.info("Executing new pass: Passageway Door Classification...")
-        roles_inv = {v: k for k, v in color_profile["roles"].items()}
-        stroke_bgr = np.array(roles_inv.get("stroke", (0, 0, 0))[::-1], dtype="uint8")
-
         processed_tiles = set()
         inset = int(grid_info.size * 0.05)
         door_search_color = (0, 255, 0)  # Green for door search areas
@@ -74,11 +69,8 @@ class StructureAnalyzer:
             px_y = y * grid_info.size + grid_info.offset_y + inset
             w = grid_info.size - (2 * inset)
             h = grid_info.size - (2 * inset)
-            tile_slice = structural_img[px_y : px_y + h, px_x : px_x + w]
-
-            # Create a mask for the specific stroke color and count those pixels.
-            stroke_mask = cv2.inRange(tile_slice, stroke_bgr, stroke_bgr)
-            if cv2.countNonZero(stroke_mask) > 10:
+            tile_stroke = stroke_mask[px_y : px_y + h, px_x : px_x + w]
+            if cv2.countNonZero(tile_stroke) > 10:
                 door_type = "door"
             else:
                 continue
@@ -139,45 +131,35 @@ class StructureAnalyzer:
         pass ensures room contiguity for the flood-fill algorithm.
         """
         log.info("Executing simplified pass: Base Tile Content Classification...")
-        classifications = {}
+        size = grid_info.size
         h, w = feature_cleaned_img.shape
-        max_gx = w // grid_info.size
-        max_gy = h // grid_info.size
-
-        for gy in range(max_gy):
-            for gx in range(max_gx):
-                px_x, px_y = gx * grid_info.size, gy * grid_info.size
-                cell_slice = feature_cleaned_img[
-                    px_y : px_y + grid_info.size, px_x : px_x + grid_info.size
-                ]
-                if cell_slice.size == 0:
-                    continue
-
-                white_pixels = cv2.countNonZero(cell_slice)
-                total_pixels = cell_slice.size
-                white_ratio = white_pixels / total_pixels if total_pixels > 0 else 0
-
-                if white_ratio < 0.20:
-                    classifications[(gx, gy)] = "empty"
-                else:
-                    classifications[(gx, gy)] = "floor"
-        return classifications
+        max_gx = w // size
+        max_gy = h // size
+
+        # Set-pixel counts of every whole cell, read off an integral image at the
+        # cell corners.
+        sums = cv2.integral((feature_cleaned_img != 0).view(np.uint8))
+        corners = sums[: (max_gy + 1) * size : size, : (max_gx + 1) * size : size]
+        white_pixels = (
+            corners[1:, 1:] - corners[:-1, 1:] - corners[1:, :-1] + corners[:-1, :-1]
+        )
+        is_floor = (white_pixels / (size * size) >= 0.20).tolist()
+
+        return {
+            (gx, gy): "floor" if is_floor[gy][gx] else "empty"
+            for gy in range(max_gy)
+            for gx in range(max_gx)
+        }
 
     def discover_grid(
         self,
-        structural_img: np.ndarray,
-        color_profile: dict,
+        stroke_mask: np.ndarray,
         room_bounds: List[Tuple[int, int, int, int]],
     ) -> _GridInfo:
         """Discovers grid size via peak-finding and offset via room bounds."""
         log_grid.info("⚙️  Executing Stage 5: Grid Discovery...")
-        roles_inv = {v: k for k, v in color_profile["roles"].items()}
-        stroke_rgb = roles_inv.get("stroke", (0, 0, 0))
-        stroke_bgr = np.array(stroke_rgb[::-1], dtype="uint8")
-        binary_mask = cv2.inRange(structural_img, stroke_bgr, stroke_bgr)
-
-        proj_x = np.sum(binary_mask, axis=0).astype(float)
-        proj_y = np.sum(binary_mask, axis=1).astype(float)
+        proj_x = np.sum(stroke_mask, axis=0).astype(float)
+        proj_y = np.sum(stroke_mask, axis=1).astype(float)
 
         sizes = []
         for axis, proj in [("x", proj_x), ("y", proj_y)]:
@@ -187,11 +169,11 @@ class StructureAnalyzer:
 
             if len(peaks) < 3:
                 continue
-            distances = np.diff(peaks)
-            mode_result = Counter(distances).most_common(1)
-            if not mode_result:
-                continue
-            grid_size = mode_result[0][0]
+            # Most frequent peak spacing; ties go to the spacing seen first.
+            spacings, first_seen, counts = np.unique(
+                np.diff(peaks), return_index=True, return_counts=True
+            )
+            grid_size = int(spacings[np.lexsort((first_seen, -counts))[0]])
             if not (10 < grid_size < 200):
                 continue
             sizes.append(grid_size)
@@ -222,10 +204,9 @@ class StructureAnalyzer:
 
     def classify_features(
         self,
-        structural_img: np.ndarray,
+        stroke_mask: np.ndarray,
         feature_cleaned_img: np.ndarray,
         grid_info: _GridInfo,
-        color_profile: Dict[str, Any],
         tile_classifications: Dict[Tuple[int, int], str],
         debug_canvas: Optional[np.ndarray] = None,
     ) -> Dict[Tuple[int, int], _TileData]:
@@ -235,11 +216,15 @@ class StructureAnalyzer:
         if not tile_classifications:
             return {}
 
-        all_coords = list(tile_classifications.keys())
-        min_gx = min(c[0] for c in all_coords)
-        max_gx = max(c[0] for c in all_coords)
-        min_gy = min(c[1] for c in all_coords)
-        max_gy = max(c[1] for c in all_coords)
+        all_coords = np.array(list(tile_classifications.keys()))
+        min_gx, min_gy = all_coords.min(axis=0).tolist()
+        max_gx, max_gy = all_coords.max(axis=0).tolist()
+
+        # Rasterize the content tiles with the same coordinate array.
+        is_content = np.zeros((max_gy - min_gy + 1, max_gx - min_gx + 1), dtype=bool)
+        content = np.array([t != "empty" for t in tile_classifications.values()])
+        content_coords = all_coords[content]
+        is_content[content_coords[:, 1] - min_gy, content_coords[:, 0] - min_gx] = True
 
         for y in range(min_gy, max_gy + 1):
             for x in range(min_gx, max_gx + 1):
@@ -251,215 +236,106 @@ class StructureAnalyzer:
             grid_info.offset_x,
             grid_info.offset_y,
         )
-        roles_inv = {v: k for k, v in color_profile["roles"].items()}
-        stroke_bgr = np.array(roles_inv.get("stroke", (0, 0, 0))[::-1], dtype="uint8")
+        # Running stroke-pixel counts, so each sampling strip is scored in O(1).
+        stroke_sums = cv2.integral(stroke_mask // 255)
+        h, w = stroke_mask.shape
         WALL_CONFIDENCE_THRESHOLD = 0.3
 
         search_thickness = max(4, grid_info.size // 4)
         half_thickness = search_thickness // 2
+        sample_half = 2  # Half-width of the strips sampled across each boundary
         inset = int(grid_info.size * 0.05)
         wall_search_color = (0, 255, 255)  # Yellow
 
-        for (x, y), tile in tile_grid.items():
-            if tile.feature_type == "empty":
+        # A wall can only sit on an edge between a content tile and an empty (or
+        # out-of-grid) neighbor. Find those edges for all tiles with array shifts.
+        padded = np.pad(is_content, 1, constant_values=False)
+        sides = [
+            ("north_wall", is_content & ~padded[:-2, 1:-1], False, False),
+            ("east_wall", is_content & ~padded[1:-1, 2:], True, True),
+            ("south_wall", is_content & ~padded[2:, 1:-1], False, True),
+            ("west_wall", is_content & ~padded[1:-1, :-2], True, False),
+        ]
+
+        # Score every open edge of one side at once. Boundaries are axis-aligned, so
+        # each is described by the pixel line it sits on and the span it covers.
+        for wall_attr, is_open, is_vertical, is_far_side in sides:
+            rows, cols = np.nonzero(is_open)
+            if rows.size == 0:
                 continue
-            p_nw = (x * grid_info.size + offset_x, y * grid_info.size + offset_y)
-            p_ne = ((x + 1) * grid_info.size + offset_x, y * grid_info.size + offset_y)
-            p_sw = (x * grid_info.size + offset_x, (y + 1) * grid_info.size + offset_y)
-            p_se = ((x + 1) * grid_size + offset_x, (y + 1) * grid_size + offset_y)
-
-            if tile_grid.get((x, y - 1), _TileData("empty")).feature_type == "empty":
-                x_start, x_end = p_nw[0] + inset, p_ne[0] - inset
-                y_center = p_nw[1]
-                r_pts = np.array(
-                    [
-                        (x_start, y_center - half_thickness),
-                        (x_end, y_center - half_thickness),
-                        (x_end, y_center + half_thickness),
-                        (x_start, y_center + half_thickness),
-                    ]
-                )
-                if debug_canvas is not None:
-                    cv2.polylines(
-                        debug_canvas, [r_pts.astype(np.int32)], True, wall_search_color, 1
-                    )
-                tile.north_wall = self._process_boundary(
-                    p_nw,
-                    p_ne,
-                    r_pts,
-                    (0, -half_thickness),
-                    False,
-                    structural_img,
-                    stroke_bgr,
-                    WALL_CONFIDENCE_THRESHOLD,
-                )
-            if tile_grid.get((x + 1, y), _TileData("empty")).feature_type == "empty":
-                y_start, y_end = p_ne[1] + inset, p_se[1] - inset
-                x_center = p_ne[0]
-                r_pts = np.array(
-                    [
-                        (x_center - half_thickness, y_start),
-                        (x_center + half_thickness, y_start),
-                        (x_center + half_thickness, y_end),
-                        (x_center - half_thickness, y_end),
-                    ]
-                )
-                if debug_canvas is not None:
-                    cv2.polylines(
-                        debug_canvas, [r_pts.astype(np.int32)], True, wall_search_color, 1
-                    )
-                tile.east_wall = self._process_boundary(
-                    p_ne,
-                    p_se,
-                    r_pts,
-                    (half_thickness, 0),
-                    True,
-                    structural_img,
-                    stroke_bgr,
-                    WALL_CONFIDENCE_THRESHOLD,
-                )
-            if tile_grid.get((x, y + 1), _TileData("empty")).feature_type == "empty":
-                x_start, x_end = p_sw[0] + inset, p_se[0] - inset
-                y_center = p_sw[1]
-                r_pts = np.array(
-                    [
-                        (x_start, y_center - half_thickness),
-                        (x_end, y_center - half_thickness),
-                        (x_end, y_center + half_thickness),
-                        (x_start, y_center + half_thickness),
-                    ]
-                )
-                if debug_canvas is not None:
-                    cv2.polylines(
-                        debug_canvas, [r_pts.astype(np.int32)], True, wall_search_color, 1
-                    )
-                tile.south_wall = self._process_boundary(
-                    p_sw,
-                    p_se,
-                    r_pts,
-                    (0, half_thickness),
-                    False,
-                    structural_img,
-                    stroke_bgr,
-                    WALL_CONFIDENCE_THRESHOLD,
-                )
-            if tile_grid.get((x - 1, y), _TileData("empty")).feature_type == "empty":
-                y_start, y_end = p_nw[1] + inset, p_sw[1] - inset
-                x_center = p_nw[0]
-                r_pts = np.array(
-                    [
-                        (x_center - half_thickness, y_start),
-                        (x_center + half_thickness, y_start),
-                        (x_center + half_thickness, y_end),
-                        (x_center - half_thickness, y_end),
-                    ]
-                )
-                if debug_canvas is not None:
+            tile_x0 = (cols + min_gx) * grid_size + offset_x
+            tile_y0 = (rows + min_gy) * grid_size + offset_y
+            if is_vertical:
+                line = tile_x0 + grid_size if is_far_side else tile_x0
+                span0, span1 = tile_y0, tile_y0 + grid_size
+            else:
+                line = tile_y0 + grid_size if is_far_side else tile_y0
+                span0, span1 = tile_x0, tile_x0 + grid_size
+
+            # Only boundaries whose search strip starts on the image are scored.
+            search = self._boundary_strip(
+                is_vertical,
+                line - half_thickness,
+                line + half_thickness,
+                span0 + inset,
+                span1 - inset,
+            )
+            if debug_canvas is not None:
+                for sx0, sy0, sx1, sy1 in zip(*search):
+                    r_pts = np.array([(sx0, sy0), (sx1, sy0), (sx1, sy1), (sx0, sy1)])
                     cv2.polylines(
                         debug_canvas, [r_pts.astype(np.int32)], True, wall_search_color, 1
                     )
-                tile.west_wall = self._process_boundary(
-                    p_nw,
-                    p_sw,
-                    r_pts,
-                    (-half_thickness, 0),
-                    True,
-                    structural_img,
-                    stroke_bgr,
-                    WALL_CONFIDENCE_THRESHOLD,
-                )
+            on_image = (np.maximum(search[0], 0) < w) & (np.maximum(search[1], 0) < h)
+
+            # A wall is a stroke across the boundary, centered on it or just outside.
+            outer = line + 2 * sample_half if is_far_side else line - 2 * sample_half
+            centered = self._strip_stroke_scores(
+                stroke_sums,
+                *self._boundary_strip(
+                    is_vertical, line - sample_half, line + sample_half, span0, span1
+                ),
+            )
+            exterior = self._strip_stroke_scores(
+                stroke_sums,
+                *self._boundary_strip(
+                    is_vertical, np.minimum(line, outer), np.maximum(line, outer), span0, span1
+                ),
+            )
+            is_wall = on_image & (np.maximum(centered, exterior) > WALL_CONFIDENCE_THRESHOLD)
+            for row, col in zip(rows[is_wall].tolist(), cols[is_wall].tolist()):
+                setattr(tile_grid[(col + min_gx, row + min_gy)], wall_attr, "stone")
         return tile_grid
 
-    def _process_boundary(
+    def _boundary_strip(
         self,
-        p1: Tuple[int, int],
-        p2: Tuple[int, int],
-        rect_points: np.ndarray,
-        exterior_offset: Tuple[int, int],
         is_vertical: bool,
-        structural_img: np.ndarray,
-        stroke_bgr: np.ndarray,
-        threshold: float,
-    ) -> Optional[str]:
-        """Helper to process a single tile boundary."""
-        bx, by, bw, bh = cv2.boundingRect(rect_points.astype(np.int32))
-
-        h, w = structural_img.shape[:2]
-        bx, by = max(0, bx), max(0, by)
-        bw, bh = min(w - bx, bw), min(h - by, bh)
-
-        boundary_slice = (
-            structural_img[by : by + bh, bx : bx + bw] if bh > 0 and bw > 0 else np.array([])
-        )
-        stroke_score = self._calculate_boundary_scores(
-            p1, p2, exterior_offset, structural_img, stroke_bgr
-        )
-        return self._classify_boundary(
-            boundary_slice, stroke_bgr, is_vertical, stroke_score, threshold
-        )
-
-    def _classify_boundary(
-        self,
-        boundary_slice: np.ndarray,
-        stroke_bgr: np.ndarray,
-        is_vertical: bool,
-        stroke_score: float,
-        threshold: float,
-    ) -> Optional[str]:
-        """Analyzes a boundary's pixel projection to classify it."""
-        if boundary_slice.size == 0:
-            return None
-
-        if stroke_score > threshold:
-            return "stone"
-        return None
-
-    def _calculate_boundary_scores(
+        across0: np.ndarray,
+        across1: np.ndarray,
+        along0: np.ndarray,
+        along1: np.ndarray,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Orders a strip's bounds across and along a boundary as (x0, y0, x1, y1)."""
+        if is_vertical:
+            return across0, along0, across1, along1
+        return along0, across0, along1, across1
+
+    def _strip_stroke_scores(
         self,
-        p1: Tuple[int, int],
-        p2: Tuple[int, int],
-        exterior_offset: Tuple[int, int],
-        structural_img: np.ndarray,
-        stroke_bgr: np.ndarray,
-    ) -> float:
-        """Calculates stroke score for a boundary using dual area-based sampling."""
-        thickness = 4
-        p1_arr, p2_arr = np.array(p1), np.array(p2)
-        vec, length = p2_arr - p1_arr, np.linalg.norm(p2_arr - p1_arr)
-
-        centered_score = 0.0
-        if length > 0:
-            vec_norm = vec / length
-            normal = np.array([-vec_norm[1], vec_norm[0]]) * (thickness / 2)
-            rect_pts = np.array(
-                [p1_arr + normal, p2_arr + normal, p2_arr - normal, p1_arr - normal],
-                dtype=np.int32,
-            )
-            mask = np.zeros(structural_img.shape[:2], dtype=np.uint8)
-            cv2.fillPoly(mask, [rect_pts], 255)
-            pixels = structural_img[mask == 255]
-            if pixels.size > 0:
-                stroke_count = np.sum(np.all(pixels == stroke_bgr, axis=1))
-                centered_score = stroke_count / pixels.shape[0]
-
-        exterior_score = 0.0
-        if length > 0:
-            shift = np.array(exterior_offset)
-            shift_norm = np.linalg.norm(shift)
-            if shift_norm > 0:
-                shift = (shift / shift_norm) * (thickness / 2)
-                p1_ext, p2_ext = p1_arr + shift, p2_arr + shift
-                vec_norm = (p2_ext - p1_ext) / np.linalg.norm(p2_ext - p1_ext)
-                normal = np.array([-vec_norm[1], vec_norm[0]]) * (thickness / 2)
-                rect_pts_ext = np.array(
-                    [p1_ext + normal, p2_ext + normal, p2_ext - normal, p1_ext - normal],
-                    dtype=np.int32,
-                )
-                mask_ext = np.zeros(structural_img.shape[:2], dtype=np.uint8)
-                cv2.fillPoly(mask_ext, [rect_pts_ext], 255)
-                pixels_ext = structural_img[mask_ext == 255]
-                if pixels_ext.size > 0:
-                    stroke_count = np.sum(np.all(pixels_ext == stroke_bgr, axis=1))
-                    exterior_score = stroke_count / pixels_ext.shape[0]
-
-        return max(centered_score, exterior_score)
+        stroke_sums: np.ndarray,
+        x0: np.ndarray,
+        y0: np.ndarray,
+        x1: np.ndarray,
+        y1: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Returns the fraction of stroke pixels in each inclusive pixel rectangle,
+        clipped to the image, from the stroke plane's integral image.
+        """
+        h, w = stroke_sums.shape[0] - 1, stroke_sums.shape[1] - 1
+        x0, y0 = np.clip(x0, 0, w), np.clip(y0, 0, h)
+        x1, y1 = np.clip(x1 + 1, 0, w), np.clip(y1 + 1, 0, h)
+        area = (x1 - x0) * (y1 - y0)
+        counts = stroke_sums[y1, x1] - stroke_sums[y0, x1] - stroke_sums[y1, x0]
+        counts = counts + stroke_sums[y0, x0]
+        return np.divide(counts, area, out=np.zeros(len(area)), where=area > 0)
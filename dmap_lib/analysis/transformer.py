@@ -3,16 +3,33 @@ import logging
 import uuid
 from typing import List, Any, Dict, Tuple
 
-from shapely.geometry import box, Polygon, MultiPolygon, Point
-from shapely.ops import unary_union
+import cv2
+import numpy as np
+import shapely
+from shapely.geometry import Polygon
 
 from dmap_lib import schema
 from .context import _RegionAnalysisContext, _TileData
+from .kernels import NUMBA_AVAILABLE, points_in_rings, ring_centroid, trace_tile_outlines
 
 log = logging.getLogger("dmap.analysis")
 log_geom = logging.getLogger("dmap.geometry")
 log_xfm = logging.getLogger("dmap.transform")
 
+# Door wall types and the properties recorded on the Door objects built from them.
+_DOOR_PROPERTIES: Dict[str, Dict[str, Any]] = {
+    "door": {},
+    "secret_door": {"secret": True},
+    "iron_bar_door": {"type": "iron_bar"},
+    "double_door": {"type": "double"},
+}
+
+
+def _doubled_area(loop: np.ndarray) -> float:
+    """Shoelace sum of an open (N, 2) loop; positive when clockwise with y down."""
+    xs, ys = loop[:, 0], loop[:, 1]
+    return np.dot(xs, np.roll(ys, -1)) - np.dot(np.roll(xs, -1), ys)
+
 
 class MapTransformer:
     """Converts the intermediate tile_grid into the final schema.MapData object."""
@@ -21,35 +38,38 @@ class MapTransformer:
         self, tile_grid: Dict[Tuple[int, int], _TileData]
     ) -> Tuple[List[Tuple[int, int]], List[Tuple[int, int]]]:
         """Classifies each floor tile as part of a chamber or a passageway."""
-        chamber_tiles, passageway_tiles = [], []
-
-        for (gx, gy), tile in tile_grid.items():
-            if tile.feature_type != "floor":
-                continue
-
-            # Check neighbors to determine tile type
-            n = tile_grid.get((gx, gy - 1))
-            s = tile_grid.get((gx, gy + 1))
-            w = tile_grid.get((gx - 1, gy))
-            e = tile_grid.get((gx + 1, gy))
-
-            has_n = n and n.feature_type == "floor"
-            has_s = s and s.feature_type == "floor"
-            has_w = w and w.feature_type == "floor"
-            has_e = e and e.feature_type == "floor"
-
-            is_vertical_passage = has_n and has_s and not has_w and not has_e
-            is_horizontal_passage = has_w and has_e and not has_n and not has_s
-
-            if is_vertical_passage or is_horizontal_passage:
-                passageway_tiles.append((gx, gy))
-            else:
-                chamber_tiles.append((gx, gy))
-
+        floor_tiles = [
+            coord for coord, tile in tile_grid.items() if tile.feature_type == "floor"
+        ]
+        if not floor_tiles:
+            return [], []
+
+        # Rasterize the floor tiles with a one-tile border so every neighbor is in range.
+        coords = np.array(floor_tiles)
+        xs = coords[:, 0] - coords[:, 0].min() + 1
+        ys = coords[:, 1] - coords[:, 1].min() + 1
+        floor = np.zeros((ys.max() + 2, xs.max() + 2), dtype=bool)
+        floor[ys, xs] = True
+
+        # Check neighbors to determine tile type
+        has_n, has_s = floor[ys - 1, xs], floor[ys + 1, xs]
+        has_w, has_e = floor[ys, xs - 1], floor[ys, xs + 1]
+        is_vertical_passage = has_n & has_s & ~has_w & ~has_e
+        is_horizontal_passage = has_w & has_e & ~has_n & ~has_s
+        is_passage = (is_vertical_passage | is_horizontal_passage).tolist()
+
+        chamber_tiles = [c for c, passage in zip(floor_tiles, is_passage) if not passage]
+        passageway_tiles = [c for c, passage in zip(floor_tiles, is_passage) if passage]
         return chamber_tiles, passageway_tiles
 
-    def transform(self, context: _RegionAnalysisContext, grid_size: int) -> List[Any]:
-        """Transforms the context object into final MapObject entities."""
+    def transform(
+        self, context: _RegionAnalysisContext, grid_size: int, region_id: str
+    ) -> List[Any]:
+        """
+        Transforms the context object into final MapObject entities. Feature and
+        layer ids are numbered within the region and carry its id, so they stay
+        unique across the whole map.
+        """
         log.info("⚙️  Executing Stage 10: Transformation to MapData...")
         tile_grid = context.tile_grid
         if not tile_grid:
@@ -63,16 +83,19 @@ class MapTransformer:
         )
 
         rooms = []
+        coord_to_room_id = {}
 
         # Create 1x1 rooms for each passageway tile
         for gx, gy in passageway_tiles:
+            x0, y0 = float(gx), float(gy)
             verts = [
-                schema.GridPoint(x=float(gx), y=float(gy)),
-                schema.GridPoint(x=float(gx + 1), y=float(gy)),
-                schema.GridPoint(x=float(gx + 1), y=float(gy + 1)),
-                schema.GridPoint(x=float(gx), y=float(gy + 1)),
+                schema.GridPoint(x0, y0),
+                schema.GridPoint(x0 + 1, y0),
+                schema.GridPoint(x0 + 1, y0 + 1),
+                schema.GridPoint(x0, y0 + 1),
             ]
             room_id = f"room_{uuid.uuid4().hex[:8]}"
+            coord_to_room_id[(gx, gy)] = room_id
             rooms.append(
                 schema.Room(
                     id=room_id,
@@ -83,24 +106,32 @@ class MapTransformer:
                 )
             )
 
-        # Merge all chamber tiles into larger room polygons
+        # Merge all chamber tiles into larger room polygons by tracing their outlines
         if chamber_tiles:
-            chamber_polygons = [box(gx, gy, gx + 1, gy + 1) for gx, gy in chamber_tiles]
-            merged_geometry = unary_union(chamber_polygons)
-
-            geometries = []
-            if isinstance(merged_geometry, MultiPolygon):
-                geometries.extend(merged_geometry.geoms)
-            elif isinstance(merged_geometry, Polygon):
-                geometries.append(merged_geometry)
-
-            for geom in geometries:
-                if geom.area < 0.5:
+            coords = np.array(chamber_tiles)
+            min_x, min_y = coords.min(axis=0).tolist()
+            max_x, max_y = coords.max(axis=0).tolist()
+            chamber_mask = np.zeros((max_y - min_y + 1, max_x - min_x + 1), dtype=bool)
+            chamber_mask[coords[:, 1] - min_y, coords[:, 0] - min_x] = True
+
+            # Each 4-connected component of the mask has exactly one outer loop.
+            _, labels = cv2.connectedComponents(chamber_mask.astype(np.uint8), connectivity=4)
+            label_to_room_id = {}
+
+            vertices, offsets = trace_tile_outlines(chamber_mask)
+            for start, end in zip(offsets[:-1], offsets[1:]):
+                loop = vertices[start:end]
+                # Outer boundaries are traced clockwise; anything else is a hole.
+                if _doubled_area(loop) <= 0:
                     continue
-                verts = [
-                    schema.GridPoint(x=float(x), y=float(y)) for x, y in geom.exterior.coords
-                ]
+                outline = self._outer_ring(loop)
+                # Reverse into the same winding as shapely's exterior, closing the ring.
+                ring = np.vstack([outline[:1], outline[:0:-1], outline[:1]]) + (min_x, min_y)
+                verts = [schema.GridPoint(x, y) for x, y in ring.astype(float).tolist()]
                 room_id = f"room_{uuid.uuid4().hex[:8]}"
+                # A loop starts at the north-west corner of one of its own tiles.
+                start_x, start_y = loop[0]
+                label_to_room_id[labels[start_y, start_x]] = room_id
                 rooms.append(
                     schema.Room(
                         id=room_id,
@@ -111,77 +142,63 @@ class MapTransformer:
                     )
                 )
 
-        log_xfm.debug("Created %d valid Room objects.", len(rooms))
+            # Map every chamber tile to its component's room, in plain ints throughout.
+            ty, tx = np.nonzero(labels)
+            tile_coords = zip((tx + min_x).tolist(), (ty + min_y).tolist())
+            tile_rooms = [label_to_room_id[label] for label in labels[ty, tx].tolist()]
+            coord_to_room_id.update(zip(tile_coords, tile_rooms))
 
-        # Rebuild coord_to_room_id map for door/feature linking
-        coord_to_room_id = {}
-        for room in rooms:
-            poly = Polygon([(v.x, v.y) for v in room.gridVertices])
-            min_x, min_y, max_x, max_y = [int(b) for b in poly.bounds]
-            for gy in range(min_y, max_y):
-                for gx in range(min_x, max_x):
-                    if poly.contains(Point(gx + 0.5, gy + 0.5)):
-                        coord_to_room_id[(gx, gy)] = room.id
+        log_xfm.debug("Created %d valid Room objects.", len(rooms))
 
         doors = self._extract_doors_from_grid(tile_grid, coord_to_room_id)
         log_xfm.debug("Extracted %d Door objects.", len(doors))
 
-        features, layers = [], []
-        room_map = {r.id: r for r in rooms}
-        room_polygons = {r.id: Polygon([(v.x, v.y) for v in room.gridVertices]) for r in rooms}
-
-        for item in context.enhancement_layers.get("features", []):
-            # Coordinates are now absolute, no grid shift needed
-            verts = [schema.GridPoint(x=v["x"], y=v["y"]) for v in item["gridVertices"]]
-            min_x = round(min(v.x for v in verts), 1)
-            min_y = round(min(v.y for v in verts), 1)
-            max_x = round(max(v.x for v in verts), 1)
-            max_y = round(max(v.y for v in verts), 1)
-            bounds = schema.BoundingBox(
-                x=min_x, y=min_y, width=round(max_x - min_x, 1), height=round(max_y - min_y, 1)
-            )
-
-            feature = schema.Feature(
-                id=f"feature_{uuid.uuid4().hex[:8]}",
-                featureType=item["featureType"],
-                shape="polygon",
-                gridVertices=verts,
-                properties=item["properties"],
-                bounds=bounds,
-            )
-            features.append(feature)
-            center = Polygon([(v.x, v.y) for v in verts]).centroid
-            for room_id, poly in room_polygons.items():
-                if poly.contains(center):
-                    if room_map[room_id].contents is not None:
-                        room_map[room_id].contents.append(feature.id)
-                    break
-
-        for item in context.enhancement_layers.get("layers", []):
-            # Coordinates are now absolute, no grid shift needed
-            verts = [schema.GridPoint(x=v["x"], y=v["y"]) for v in item["gridVertices"]]
-            min_x = round(min(v.x for v in verts), 1)
-            min_y = round(min(v.y for v in verts), 1)
-            max_x = round(max(v.x for v in verts), 1)
-            max_y = round(max(v.y for v in verts), 1)
-            bounds = schema.BoundingBox(
-                x=min_x, y=min_y, width=round(max_x - min_x, 1), height=round(max_y - min_y, 1)
-            )
+        # Room outlines and their bounding boxes, built once for all containment tests.
+        # Ring r is room_vertices[room_offsets[r]:room_offsets[r + 1]].
+        room_offsets = np.cumsum([0] + [len(r.gridVertices) for r in rooms])
+        room_vertices = np.array(
+            [(v.x, v.y) for r in rooms for v in r.gridVertices], dtype=np.float64
+        ).reshape(-1, 2)
+        room_bounds = np.hstack(
+            [
+                np.minimum.reduceat(room_vertices, room_offsets[:-1]),
+                np.maximum.reduceat(room_vertices, room_offsets[:-1]),
+            ]
+        )
 
-            layer = schema.EnvironmentalLayer(
-                id=f"layer_{uuid.uuid4().hex[:8]}",
-                layerType=item["layerType"],
-                gridVertices=verts,
-                properties=item["properties"],
-                bounds=bounds,
-            )
-            layers.append(layer)
-            center = Polygon([(v.x, v.y) for v in verts]).centroid
-            for room_id, poly in room_polygons.items():
-                if poly.contains(center):
-                    if room_map[room_id].contents is not None:
-                        room_map[room_id].contents.append(layer.id)
-                    break
+        feature_items = context.enhancement_layers.get("features", [])
+        layer_items = context.enhancement_layers.get("layers", [])
+        items = feature_items + layer_items
+        kinds = ["feature"] * len(feature_items) + ["layer"] * len(layer_items)
+        ids = [f"feature_{region_id}_{i}" for i in range(len(feature_items))]
+        ids += [f"layer_{region_id}_{i}" for i in range(len(layer_items))]
+
+        # All enhancement vertices in one array; item i owns rows offsets[i]:offsets[i + 1].
+        offsets = np.cumsum([0] + [len(item["gridVertices"]) for item in items]).tolist()
+        flat = np.array(
+            [(v["x"], v["y"]) for item in items for v in item["gridVertices"]],
+            dtype=np.float64,
+        ).reshape(-1, 2)
+        item_coords = [flat[start:end] for start, end in zip(offsets, offsets[1:])]
+        objects = [
+            self._enhancement_object(item, kind, obj_id, coords)
+            for item, kind, obj_id, coords in zip(items, kinds, ids, item_coords)
+        ]
+        features, layers = objects[: len(feature_items)], objects[len(feature_items) :]
+
+        # Place each feature and layer in the first room containing its centroid.
+        centers = [self._polygon_centroid(coords) for coords in item_coords]
+        centers_arr = np.array(centers, dtype=float).reshape(-1, 2)
+        room_idx = self._rooms_containing(
+            room_vertices, room_offsets, room_bounds, centers_arr
+        )
+        # Contents list per room, resolved once; the trailing None is what the -1
+        # "no room" index picks up, so unplaced items need no separate check.
+        room_contents = [r.contents for r in rooms] + [None]
+        for obj, idx in zip(objects, room_idx.tolist()):
+            contents = room_contents[idx]
+            if contents is not None:
+                contents.append(obj.id)
         log_xfm.debug(
             "Created %d features and %d layers from enhancements.", len(features), len(layers)
         )
@@ -197,69 +214,143 @@ class MapTransformer:
         )
         return all_objects
 
+    def _enhancement_object(
+        self, item: Dict[str, Any], kind: str, obj_id: str, coords: np.ndarray
+    ) -> Any:
+        """
+        Builds the schema Feature or EnvironmentalLayer for one enhancement item,
+        whose vertices are given as an (N, 2) float array.
+        """
+        # Coordinates are now absolute, no grid shift needed
+        common = {
+            "id": obj_id,
+            "gridVertices": [schema.GridPoint(x, y) for x, y in coords.tolist()],
+            "properties": item["properties"],
+            "bounds": self._bounding_box(coords),
+        }
+        if kind == "feature":
+            return schema.Feature(featureType=item["featureType"], shape="polygon", **common)
+        return schema.EnvironmentalLayer(layerType=item["layerType"], **common)
+
+    def _rooms_containing(
+        self,
+        vertices: np.ndarray,
+        offsets: np.ndarray,
+        bounds: np.ndarray,
+        points: np.ndarray,
+    ) -> np.ndarray:
+        """
+        Returns, for each (x, y) point, the index of the first room ring containing
+        it, or -1. Points are checked against the cached ring bounding boxes first, so
+        the exact point-in-ring test only runs on the pairs that survive.
+        """
+        first = np.full(len(points), -1)
+        if len(points) == 0 or len(bounds) == 0:
+            return first
+        xs, ys = points[:, :1], points[:, 1:]
+        in_box = (xs >= bounds[:, 0]) & (xs <= bounds[:, 2])
+        in_box &= (ys >= bounds[:, 1]) & (ys <= bounds[:, 3])
+        point_idx, poly_idx = np.nonzero(in_box)
+        if NUMBA_AVAILABLE:
+            inside = points_in_rings(
+                np.ascontiguousarray(xs[:, 0]),
+                np.ascontiguousarray(ys[:, 0]),
+                point_idx,
+                poly_idx,
+                vertices,
+                offsets,
+            )
+        else:
+            # The kernel is plain Python without Numba; GEOS with prepared rooms wins.
+            ring_ids = np.repeat(np.arange(len(bounds)), np.diff(offsets))
+            polygons = shapely.polygons(shapely.linearrings(vertices, indices=ring_ids))
+            shapely.prepare(polygons)
+            inside = shapely.contains_xy(
+                polygons[poly_idx], xs[point_idx, 0], ys[point_idx, 0]
+            )
+        point_idx, poly_idx = point_idx[inside], poly_idx[inside]
+        # Hits are ordered by point, then polygon, so the first hit per point wins.
+        hit_points, first_hit = np.unique(point_idx, return_index=True)
+        first[hit_points] = poly_idx[first_hit]
+        return first
+
+    def _outer_ring(self, loop: np.ndarray) -> np.ndarray:
+        """
+        Returns a traced outer loop without the holes it touches at a corner.
+
+        The tracer walks into such a hole through the shared vertex and back out, so
+        the loop revisits that vertex and is not a valid ring. Splitting it at every
+        repeated vertex and keeping the clockwise piece gives the same simple ring as
+        the exterior of the union of the tiles.
+        """
+        if len(np.unique(loop, axis=0)) == len(loop):
+            return loop
+        pieces, stack, seen = [], [], {}
+        for vertex in map(tuple, loop.tolist()):
+            if vertex in seen:
+                start = seen[vertex]
+                pieces.append(stack[start:])
+                for dropped in stack[start + 1 :]:
+                    del seen[dropped]
+                del stack[start + 1 :]
+            else:
+                seen[vertex] = len(stack)
+                stack.append(vertex)
+        pieces.append(stack)
+        return max((np.array(p, dtype=loop.dtype) for p in pieces), key=_doubled_area)
+
+    def _polygon_centroid(self, pts: np.ndarray) -> Tuple[float, float]:
+        """
+        Returns the area centroid of an (N, 2) float64 ring, matching shapely's
+        Polygon.centroid without building a polygon. Degenerate rings still go
+        through shapely.
+        """
+        if (pts[0] != pts[-1]).any():
+            pts = np.vstack([pts, pts[:1]])
+        cx, cy, area = ring_centroid(pts)
+        if area == 0:
+            center = Polygon(pts).centroid
+            return center.x, center.y
+        return float(cx), float(cy)
+
+    def _bounding_box(self, coords: np.ndarray) -> schema.BoundingBox:
+        """Returns the rounded bounding box of an (N, 2) array of vertices."""
+        min_x, min_y = (round(c, 1) for c in coords.min(axis=0).tolist())
+        max_x, max_y = (round(c, 1) for c in coords.max(axis=0).tolist())
+        return schema.BoundingBox(
+            x=min_x, y=min_y, width=round(max_x - min_x, 1), height=round(max_y - min_y, 1)
+        )
+
     def _extract_doors_from_grid(self, tile_grid, coord_to_room_id):
         """Finds all doors on tile edges and links the adjacent rooms."""
         doors = []
-        processed_edges = set()
-        door_types = ("door", "secret_door", "iron_bar_door", "double_door")
-
-        for (gx, gy), tile in tile_grid.items():
-            if tile.feature_type != "floor":
-                continue
-
-            # South Wall Check
-            wall_type = tile.south_wall
-            if wall_type in door_types:
-                edge = tuple(sorted(((gx, gy), (gx, gy + 1))))
-                if edge not in processed_edges:
-                    r1 = coord_to_room_id.get((gx, gy))
-                    r2 = coord_to_room_id.get((gx, gy + 1))
-                    if r1 and r2 and r1 != r2:
-                        props = {}
-                        if wall_type == "secret_door":
-                            props["secret"] = True
-                        elif wall_type == "iron_bar_door":
-                            props["type"] = "iron_bar"
-                        elif wall_type == "double_door":
-                            props["type"] = "double"
-
-                        pos = schema.GridPoint(x=float(gx), y=float(gy + 1))
-                        doors.append(
-                            schema.Door(
-                                id=f"door_{uuid.uuid4().hex[:8]}",
-                                gridPos=pos,
-                                orientation="h",
-                                connects=[r1, r2],
-                                properties=props if props else None,
-                            )
-                        )
-                        processed_edges.add(edge)
-
-            # East Wall Check
-            wall_type = tile.east_wall
-            if wall_type in door_types:
-                edge = tuple(sorted(((gx, gy), (gx + 1, gy))))
-                if edge not in processed_edges:
-                    r1 = coord_to_room_id.get((gx, gy))
-                    r2 = coord_to_room_id.get((gx + 1, gy))
-                    if r1 and r2 and r1 != r2:
-                        props = {}
-                        if wall_type == "secret_door":
-                            props["secret"] = True
-                        elif wall_type == "iron_bar_door":
-                            props["type"] = "iron_bar"
-                        elif wall_type == "double_door":
-                            props["type"] = "double"
-
-                        pos = schema.GridPoint(x=float(gx + 1), y=float(gy))
-                        doors.append(
-                            schema.Door(
-                                id=f"door_{uuid.uuid4().hex[:8]}",
-                                gridPos=pos,
-                                orientation="v",
-                                connects=[r1, r2],
-                                properties=props if props else None,
-                            )
+        # Only the few floor tiles with a door on their south or east wall matter.
+        door_tiles = [
+            (coord, tile)
+            for coord, tile in tile_grid.items()
+            if tile.feature_type == "floor"
+            and (tile.south_wall in _DOOR_PROPERTIES or tile.east_wall in _DOOR_PROPERTIES)
+        ]
+
+        for (gx, gy), tile in door_tiles:
+            # Each tile owns its south and east edges, so every edge is seen once.
+            for wall_type, (nx, ny), orientation in (
+                (tile.south_wall, (gx, gy + 1), "h"),
+                (tile.east_wall, (gx + 1, gy), "v"),
+            ):
+                if wall_type not in _DOOR_PROPERTIES:
+                    continue
+                r1 = coord_to_room_id.get((gx, gy))
+                r2 = coord_to_room_id.get((nx, ny))
+                if r1 and r2 and r1 != r2:
+                    props = _DOOR_PROPERTIES[wall_type]
+                    doors.append(
+                        schema.Door(
+                            id=f"door_{uuid.uuid4().hex[:8]}",
+                            gridPos=schema.GridPoint(float(nx), float(ny)),
+                            orientation=orientation,
+                            connects=[r1, r2],
+                            properties=dict(props) if props else None,
                         )
-                        processed_edges.add(edge)
+                    )
         return doors
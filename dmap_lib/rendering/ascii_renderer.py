@@ -1,10 +1,15 @@
 # --- dmap_lib/rendering/ascii_renderer.py ---
 from typing import List
-from shapely.geometry import Polygon, Point
+
+import cv2
+import numpy as np
 
 from dmap_lib import schema
 from dmap_lib.analysis.context import _TileData
 
+# Shared read-only stand-in for tiles outside the grid in neighbour lookups.
+_EMPTY_TILE = _TileData(feature_type="empty")
+
 
 class ASCIIRenderer:
     """Renders a high-fidelity ASCII art diagram of a map for debugging."""
@@ -31,31 +36,34 @@ class ASCIIRenderer:
         min_x, max_x = min(v.x for v in all_verts), max(v.x for v in all_verts)
         min_y, max_y = min(v.y for v in all_verts), max(v.y for v in all_verts)
 
-        tile_grid = {}
-        for y in range(int(min_y) - 1, int(max_y) + 2):
-            for x in range(int(min_x) - 1, int(max_x) + 2):
-                tile_grid[(x, y)] = _TileData(feature_type="empty")
+        x0, y0 = int(min_x) - 1, int(min_y) - 1
+        cols, rows = int(max_x) + 2 - x0, int(max_y) + 2 - y0
 
+        # Rasterize the rooms at twice the grid resolution. Room vertices sit on grid
+        # corners (even pixels), so each tile center (odd pixel) is plainly in or out.
+        floor_mask = np.zeros((2 * rows, 2 * cols), dtype=np.uint8)
         for obj in all_objects:
             if isinstance(obj, schema.Room):
-                poly = Polygon([(v.x, v.y) for v in obj.gridVertices])
-                r_min_x, r_min_y, r_max_x, r_max_y = [int(b) for b in poly.bounds]
-                for y in range(r_min_y, r_max_y + 1):
-                    for x in range(r_min_x, r_max_x + 1):
-                        if poly.contains(Point(x + 0.5, y + 0.5)):
-                            if (x, y) in tile_grid:
-                                tile_grid[(x, y)].feature_type = "floor"
+                ring = np.array([(v.x - x0, v.y - y0) for v in obj.gridVertices]) * 2
+                cv2.fillPoly(floor_mask, [np.round(ring).astype(np.int32)], 1)
+        is_floor = floor_mask[1::2, 1::2]
+
+        tile_grid = {}
+        for y in range(y0, y0 + rows):
+            for x in range(x0, x0 + cols):
+                feature_type = "floor" if is_floor[y - y0, x - x0] else "empty"
+                tile_grid[(x, y)] = _TileData(feature_type=feature_type)
 
         for (x, y), tile in tile_grid.items():
             if tile.feature_type == "empty":
                 continue
-            if tile_grid.get((x, y - 1), _TileData("empty")).feature_type == "empty":
+            if tile_grid.get((x, y - 1), _EMPTY_TILE).feature_type == "empty":
                 tile.north_wall = "stone"
-            if tile_grid.get((x + 1, y), _TileData("empty")).feature_type == "empty":
+            if tile_grid.get((x + 1, y), _EMPTY_TILE).feature_type == "empty":
                 tile.east_wall = "stone"
-            if tile_grid.get((x, y + 1), _TileData("empty")).feature_type == "empty":
+            if tile_grid.get((x, y + 1), _EMPTY_TILE).feature_type == "empty":
                 tile.south_wall = "stone"
-            if tile_grid.get((x - 1, y), _TileData("empty")).feature_type == "empty":
+            if tile_grid.get((x - 1, y), _EMPTY_TILE).feature_type == "empty":
                 tile.west_wall = "stone"
 
         for obj in all_objects:
@@ -6,7 +6,9 @@ from collections import defaultdict
 from dataclasses import dataclass
 
 import numpy as np
+import shapely
 from shapely.geometry import Polygon, MultiPolygon, LineString
+from shapely.strtree import STRtree
 from shapely.ops import unary_union
 
 from dmap_lib import schema
@@ -93,26 +95,31 @@ def merge_adjacent_rooms(
         if root_i != root_j:
             parent[root_j] = root_i
 
-    # Iterate through all pairs of rooms to check for adjacency without doors
+    # Find every pair of touching rooms with one spatial index query, and all their
+    # shared walls with one vectorized intersection. Each wall is then checked for
+    # doors, visiting the pairs in the same order as a nested loop.
     room_ids = list(room_map.keys())
-    for i in range(len(room_ids)):
-        for j in range(i + 1, len(room_ids)):
-            id1, id2 = room_ids[i], room_ids[j]
-            if find(id1) == find(id2):
-                continue
-            poly1, poly2 = polygons[id1], polygons[id2]
-            if poly1.touches(poly2):
-                intersection = poly1.intersection(poly2)
-                if isinstance(intersection, LineString) and intersection.length > 0.1:
-                    coords = list(intersection.coords)
-                    has_door = False
-                    for k in range(len(coords) - 1):
-                        wall = tuple(sorted((coords[k], coords[k + 1])))
-                        if wall in door_walls:
-                            has_door = True
-                            break
-                    if not has_door:
-                        union(id1, id2)
+    tree = STRtree([polygons[room_id] for room_id in room_ids])
+    src, dst = tree.query(tree.geometries, predicate="touches")
+    touching_pairs = sorted((i, j) for i, j in zip(src.tolist(), dst.tolist()) if i < j)
+    pair_idx = np.array(touching_pairs, dtype=int).reshape(-1, 2)
+    shared_walls = shapely.intersection(
+        tree.geometries[pair_idx[:, 0]], tree.geometries[pair_idx[:, 1]]
+    )
+    for (i, j), intersection in zip(touching_pairs, shared_walls):
+        id1, id2 = room_ids[i], room_ids[j]
+        if find(id1) == find(id2):
+            continue
+        if isinstance(intersection, LineString) and intersection.length > 0.1:
+            coords = list(intersection.coords)
+            has_door = False
+            for k in range(len(coords) - 1):
+                wall = tuple(sorted((coords[k], coords[k + 1])))
+                if wall in door_walls:
+                    has_door = True
+                    break
+            if not has_door:
+                union(id1, id2)
 
     # Group rooms by their root parent in the DSU structure
     merged_groups = defaultdict(list)
@@ -3,6 +3,7 @@ import logging
 import math
 from typing import List, Dict, Any
 from collections import defaultdict
+import shapely
 from shapely.geometry import Polygon, MultiPolygon
 from shapely.ops import unary_union
 
@@ -255,22 +256,10 @@ class SVGRenderer:
 
         renderable_shapes = [o for o in objects_to_render if isinstance(o, _RenderableShape)]
         all_polys = [s.polygon for s in renderable_shapes]
-        pixel_polys = [
-            Polygon(
-                [
-                    (v[0] * self.PIXELS_PER_GRID, v[1] * self.PIXELS_PER_GRID)
-                    for v in p.exterior.coords
-                ],
-                [
-                    [
-                        (v[0] * self.PIXELS_PER_GRID, v[1] * self.PIXELS_PER_GRID)
-                        for v in hole.coords
-                    ]
-                    for hole in p.interiors
-                ],
-            )
-            for p in all_polys
-        ]
+        # Scale every ring of every shape to pixels in one vectorized pass.
+        pixel_polys = shapely.transform(
+            all_polys, lambda coords: coords * self.PIXELS_PER_GRID
+        )
         unified_pixel_geometry = unary_union(pixel_polys).buffer(0)
 
         geoms_to_fill = (
@@ -8,6 +8,9 @@ from typing import Any, Dict, List, Optional, Union
 class GridPoint:
     """Represents a single point in the grid-based coordinate system."""
 
+    # Maps carry thousands of vertices; slots keep each one free of a __dict__.
+    __slots__ = ("x", "y")
+
     x: float
     y: float
 
@@ -0,0 +1,66 @@
+from collections import Counter
+
+import cv2
+import numpy as np
+import pytest
+
+from dmap_lib.analysis import color
+from dmap_lib.analysis.analyzer import MapAnalyzer
+
+# Rooms and the corridors joining them, as (x, y, w, h) in grid tiles.
+ROOMS = [(0, 0, 6, 5), (8, 0, 5, 4), (0, 7, 4, 5), (6, 6, 7, 6), (15, 1, 4, 8)]
+CORRIDORS = [(6, 2, 2, 1), (2, 5, 1, 2), (13, 2, 2, 1), (9, 4, 1, 2)]
+
+
+@pytest.fixture
+def map_image():
+    # Large enough that the palette is fitted on a sample; seed 3 is a map on which
+    # three k-means restarts on that sample lose the water cluster.
+    grid, margin = 40, 20
+    img = np.full((12 * grid + 2 * margin, 19 * grid + 2 * margin, 3), 255, dtype=np.uint8)
+
+    def tile(x, y):
+        return margin + x * grid, margin + y * grid
+
+    boxes = [tile(x, y) + tile(x + w, y + h) for x, y, w, h in ROOMS + CORRIDORS]
+    for x1, y1, x2, y2 in boxes:
+        cv2.rectangle(img, (x1 + 6, y1 + 6), (x2 + 6, y2 + 6), (120, 120, 120), -1)  # shadow
+    for x1, y1, x2, y2 in boxes:
+        cv2.rectangle(img, (x1, y1), (x2, y2), (180, 210, 225), -1)  # floor
+        for gx in range(x1 + grid, x2, grid):
+            cv2.line(img, (gx, y1), (gx, y2), (150, 175, 195), 1)  # grid lines
+        for gy in range(y1 + grid, y2, grid):
+            cv2.line(img, (x1, gy), (x2, gy), (150, 175, 195), 1)
+    for x1, y1, x2, y2 in boxes:
+        cv2.rectangle(img, (x1, y1), (x2, y2), (20, 20, 20), 4, cv2.LINE_AA)  # stroke
+    for x1, y1, x2, y2 in boxes[len(ROOMS) :]:
+        # Open the walls where each corridor meets its rooms.
+        if x2 - x1 > y2 - y1:
+            cv2.rectangle(img, (x1 - 3, y1 + 4), (x2 + 3, y2 - 4), (180, 210, 225), -1)
+        else:
+            cv2.rectangle(img, (x1 + 4, y1 - 3), (x2 - 4, y2 + 3), (180, 210, 225), -1)
+    (x1, y1), (x2, y2) = tile(7, 7), tile(10, 9)
+    cv2.rectangle(img, (x1 + 5, y1 + 5), (x2 - 5, y2 - 5), (200, 120, 40), -1)  # water
+    noise = np.random.default_rng(3).integers(-3, 4, img.shape)
+    return np.clip(img.astype(int) + noise, 0, 255).astype(np.uint8)
+
+
+def analysis_summary(img):
+    profile = color.ColorAnalyzer().analyze(img)
+    roles = {role: color.unpack_rgb(key) for key, role in profile["roles"].items()}
+    region = MapAnalyzer().analyze_region(img, {"id": "region_0"})
+    return roles, Counter(o.type for o in region.mapObjects)
+
+
+def test_sampled_palette_fit_matches_full_fit(map_image, monkeypatch):
+    assert map_image.shape[0] * map_image.shape[1] > color._MAX_FIT_PIXELS
+    roles, objects = analysis_summary(map_image)
+
+    monkeypatch.setattr(color, "_MAX_FIT_PIXELS", map_image.size)
+    full_roles, full_objects = analysis_summary(map_image)
+
+    assert "water" in roles
+    assert roles.keys() == full_roles.keys()
+    for role, rgb in roles.items():
+        assert np.abs(np.subtract(rgb, full_roles[role])).max() <= 2, role
+    assert objects == full_objects
@@ -0,0 +1,121 @@
+import os
+
+import cv2
+import numpy as np
+import pytest
+from sklearn.cluster import KMeans
+
+from dmap_lib.analysis.color import ColorAnalyzer, _alias_roles
+
+
+@pytest.fixture
+def map_image():
+    rng = np.random.default_rng(0)
+    img = np.full((240, 320, 3), 255, dtype=np.uint8)
+    cv2.rectangle(img, (46, 46), (286, 206), (120, 120, 120), -1)  # shadow
+    cv2.rectangle(img, (36, 36), (276, 196), (235, 245, 250), -1)  # glow
+    cv2.rectangle(img, (40, 40), (280, 200), (180, 210, 225), -1)  # floor
+    cv2.rectangle(img, (40, 40), (280, 200), (20, 20, 20), 4)  # stroke
+    cv2.rectangle(img, (120, 90), (200, 150), (200, 120, 40), -1)  # water
+    noise = rng.integers(-3, 4, img.shape)
+    return np.clip(img.astype(int) + noise, 0, 255).astype(np.uint8)
+
+
+def profile_summary(profile):
+    return (
+        [tuple(c) for c in profile["palette"]],
+        dict(profile["roles"]),
+        profile["labels"].tobytes(),
+    )
+
+
+def test_palette_cache_is_opt_in(map_image, tmp_path, monkeypatch):
+    monkeypatch.setenv("HOME", str(tmp_path))
+    ColorAnalyzer().analyze(map_image, num_colors=6)
+    assert not os.listdir(tmp_path)
+
+
+def test_cached_palette_matches_cold_fit(map_image, tmp_path):
+    expected = profile_summary(ColorAnalyzer().analyze(map_image, num_colors=6))
+    analyzer = ColorAnalyzer(cache_dir=str(tmp_path))
+
+    cold = profile_summary(analyzer.analyze(map_image, num_colors=6))
+    assert len(os.listdir(tmp_path)) == 1
+    warm = profile_summary(analyzer.analyze(map_image, num_colors=6))
+    assert cold == expected
+    assert warm == expected
+
+
+@pytest.mark.parametrize("damage", ["truncate", "empty"])
+def test_damaged_cache_falls_back_to_cold_fit(map_image, tmp_path, damage):
+    expected = profile_summary(ColorAnalyzer().analyze(map_image, num_colors=6))
+    analyzer = ColorAnalyzer(cache_dir=str(tmp_path))
+    analyzer.analyze(map_image, num_colors=6)
+
+    (cache_file,) = tmp_path.iterdir()
+    data = cache_file.read_bytes()
+    cache_file.write_bytes(data[: len(data) // 2] if damage == "truncate" else b"")
+
+    assert profile_summary(analyzer.analyze(map_image, num_colors=6)) == expected
+    assert sorted(os.listdir(tmp_path)) == [cache_file.name]
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_label_pixels_matches_predict(seed):
+    rng = np.random.default_rng(seed)
+    num_colors = int(rng.integers(2, 13))
+    centers = rng.uniform(0, 255, size=(num_colors, 3)).astype(np.float32)
+    if seed % 2:
+        # Centres on a coarse lattice put exact ties on bucket edges and pixel values.
+        centers = np.round(centers / 4) * 4
+    kmeans = KMeans(n_clusters=num_colors, init=centers, n_init=1).fit(centers)
+
+    # Random colors, colors on the first and last value of each LUT bucket, and greys.
+    edges = np.concatenate([np.arange(0, 256, 8), np.arange(7, 256, 8)])
+    img = np.concatenate(
+        [
+            rng.integers(0, 256, size=(64, 64, 3)),
+            rng.choice(edges, size=(64, 64, 3)),
+            np.repeat(np.arange(256).reshape(64, 4, 1), 3, axis=2),
+        ],
+        axis=1,
+    ).astype(np.uint8)
+
+    expected = kmeans.predict(img.reshape(-1, 3).astype(np.float32)).reshape(img.shape[:2])
+    np.testing.assert_array_equal(ColorAnalyzer().label_pixels(img, kmeans), expected)
+
+
+def uint8_rgb(*rgb):
+    # Palette colors come from the uint8 cluster centres, as in ColorAnalyzer.analyze.
+    return tuple(np.uint8(c) for c in rgb)
+
+
+PRIMARY_ROLES = [
+    (uint8_rgb(255, 255, 255), "floor"),
+    (uint8_rgb(20, 20, 20), "stroke"),
+    (uint8_rgb(189, 172, 148), "shadow"),
+    (uint8_rgb(40, 119, 200), "water"),
+]
+
+
+def test_alias_roles_do_not_wrap_around():
+    aliases = [uint8_rgb(250, 250, 250), uint8_rgb(128, 128, 128), uint8_rgb(30, 25, 25)]
+    # Wrapping uint8 differences would send both the near-white and the grey to stroke.
+    assert _alias_roles(aliases, PRIMARY_ROLES) == [
+        "alias_floor",
+        "alias_shadow",
+        "alias_stroke",
+    ]
+
+
+def test_alias_roles_pick_nearest_primary():
+    rng = np.random.default_rng(0)
+    aliases = [uint8_rgb(*c) for c in rng.integers(0, 256, size=(500, 3))]
+    expected = []
+    for alias in aliases:
+        nearest = min(
+            PRIMARY_ROLES,
+            key=lambda item: sum((int(a) - int(p)) ** 2 for a, p in zip(alias, item[0])),
+        )
+        expected.append(f"alias_{nearest[1]}")
+    assert _alias_roles(aliases, PRIMARY_ROLES) == expected
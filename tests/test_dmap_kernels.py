@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+import shapely
+from shapely.geometry import MultiPoint, Polygon, box
+from shapely.ops import unary_union
+
+from dmap_lib.analysis.context import _RegionAnalysisContext, _TileData
+from dmap_lib.analysis.kernels import points_in_rings, ring_centroid, trace_tile_outlines
+from dmap_lib.analysis.transformer import MapTransformer
+
+# A hole touching the notch on the left edge at a corner, rows top to bottom.
+PINCHED_GRID = ["####", "####", "##.#", ".###", "#.##", "####"]
+
+
+def random_grids(count, seed=0):
+    rng = np.random.default_rng(seed)
+    grids = []
+    for _ in range(count):
+        h, w = rng.integers(1, 13, size=2)
+        rows = rng.random((h, w)) < 0.7
+        grids.append(["".join("#" if c else "." for c in row) for row in rows])
+    return grids
+
+
+def grid_mask(rows):
+    return np.array([[c == "#" for c in row] for row in rows], dtype=bool)
+
+
+def chamber_rooms(rows):
+    tile_grid = {
+        (x, y): _TileData(feature_type="floor" if c == "#" else "empty")
+        for y, row in enumerate(rows)
+        for x, c in enumerate(row)
+    }
+    transformer = MapTransformer()
+    chamber_tiles, _ = transformer._classify_floor_tiles(tile_grid)
+    objects = transformer.transform(
+        _RegionAnalysisContext(tile_grid=tile_grid), 50, "region_0"
+    )
+    rooms = [o for o in objects if getattr(o, "roomType", None) == "chamber"]
+    return rooms, chamber_tiles
+
+
+@pytest.mark.parametrize("rows", [PINCHED_GRID] + random_grids(200))
+def test_chamber_rings_match_tile_union(rows):
+    rooms, chamber_tiles = chamber_rooms(rows)
+    polygons = [Polygon([(v.x, v.y) for v in room.gridVertices]) for room in rooms]
+    for polygon in polygons:
+        assert polygon.is_valid, shapely.is_valid_reason(polygon)
+
+    expected = []
+    if chamber_tiles:
+        union = unary_union([box(x, y, x + 1, y + 1) for x, y in chamber_tiles])
+        expected = [Polygon(p.exterior) for p in getattr(union, "geoms", [union])]
+    assert len(polygons) == len(expected)
+    for polygon in polygons:
+        assert any(polygon.normalize().equals_exact(e.normalize(), 0) for e in expected)
+
+
+def test_pinched_grid_rooms_do_not_revisit_vertices():
+    rooms, _ = chamber_rooms(PINCHED_GRID)
+    assert rooms
+    for room in rooms:
+        ring = [(v.x, v.y) for v in room.gridVertices]
+        assert len(ring) - 1 == len(set(ring))
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_points_in_rings_matches_shapely(seed):
+    rng = np.random.default_rng(seed)
+    mask = rng.random((8, 8)) < 0.6
+    vertices, offsets = trace_tile_outlines(mask)
+    vertices = vertices.astype(np.float64)
+    rings = [vertices[s:e] for s, e in zip(offsets[:-1], offsets[1:])]
+    polygons = [Polygon(ring) for ring in rings]
+
+    # Half-tile steps put points on edges and corners as well as inside tiles.
+    xs = rng.integers(-2, 19, size=300) / 2.0
+    ys = rng.integers(-2, 19, size=300) / 2.0
+    point_idx, ring_idx = np.meshgrid(np.arange(len(xs)), np.arange(len(rings)))
+    point_idx, ring_idx = point_idx.ravel(), ring_idx.ravel()
+
+    inside = points_in_rings(xs, ys, point_idx, ring_idx, vertices, offsets)
+    expected = shapely.contains_xy(np.array(polygons)[ring_idx], xs[point_idx], ys[point_idx])
+    np.testing.assert_array_equal(inside, expected)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_ring_centroid_matches_shapely(seed):
+    rng = np.random.default_rng(seed)
+    polygon = MultiPoint(rng.uniform(-50, 50, size=(12, 2))).convex_hull
+    ring = np.asarray(polygon.exterior.coords, dtype=np.float64)
+    cx, cy, area = ring_centroid(ring)
+    assert area != 0
+    assert (cx, cy) == (polygon.centroid.x, polygon.centroid.y)
+
+
+def test_ring_centroid_of_traced_outline():
+    vertices, offsets = trace_tile_outlines(grid_mask(PINCHED_GRID))
+    loop = vertices[offsets[0] : offsets[1]].astype(np.float64)
+    ring = np.vstack([loop, loop[:1]])
+    cx, cy, area = ring_centroid(ring)
+    expected = Polygon(ring).centroid
+    assert (cx, cy) == pytest.approx((expected.x, expected.y))
+    assert area != 0